@@ -0,0 +1,33 @@
+BYTE_MAX = 255
+BYTES = range(BYTE_MAX + 1)
+
+
+def _unary(f):
+    return bytes(f(a) for a in BYTES)
+
+
+def _binary(f):
+    # indexed by a << 8 | b
+    return bytes(f(a, b) for a in BYTES for b in BYTES)
+
+
+# imodes that map the current cell through a 256 entry table
+UNARY = {
+    12: _unary(lambda a: a + 97 if a < 26 else a),
+    13: _unary(lambda a: a + 65 if a < 26 else a),
+    14: _unary(lambda a: a + 48 if a < 10 else a),
+    15: _unary(lambda a: (43, 45, 60, 62, 91, 93, 61, 63)[a] if a < 8 else a),
+    22: _unary(lambda a: 0 if a else 1),
+    }
+
+# imodes that combine the current cell with the head of the io buffer,
+# saturating at 0 and BYTE_MAX. Dividing by zero leaves the cell alone.
+BINARY = {
+    16: _binary(lambda a, b: min(a + b, BYTE_MAX)),
+    17: _binary(lambda a, b: max(a - b, 0)),
+    18: _binary(lambda a, b: min(a * b, BYTE_MAX)),
+    19: _binary(lambda a, b: a // b if b else a),
+    20: _binary(lambda a, b: a & b),
+    21: _binary(lambda a, b: a | b),
+    23: _binary(lambda a, b: a ^ b),
+    }
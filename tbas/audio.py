@@ -0,0 +1,153 @@
+import math
+import os
+import sys
+import threading
+import wave
+
+from array import array
+from functools import lru_cache
+from itertools import count
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+SAMPLE_RATE = 8000
+AMPLITUDE = 16000
+# 16 bit signed little-endian mono
+SAMPLE_WIDTH = 2
+
+DTMF = {
+    '1': (697, 1209), '2': (697, 1336), '3': (697, 1477), 'A': (697, 1633),
+    '4': (770, 1209), '5': (770, 1336), '6': (770, 1477), 'B': (770, 1633),
+    '7': (852, 1209), '8': (852, 1336), '9': (852, 1477), 'C': (852, 1633),
+    '*': (941, 1209), '0': (941, 1336), '#': (941, 1477), 'D': (941, 1633),
+    }
+DIGIT_MS = 100
+GAP_MS = 50
+PAUSE_MS = 500
+
+
+def _samples(ms, rate):
+    return rate * ms // 1000
+
+
+@lru_cache(maxsize=1024)
+def tone(frequencies, ms, rate=SAMPLE_RATE):
+    """PCM for the sum of sine waves at frequencies (a tuple, empty for
+    silence) lasting ms milliseconds."""
+    n = _samples(ms, rate)
+    if not frequencies:
+        return bytes(n * SAMPLE_WIDTH)
+    scale = AMPLITUDE / len(frequencies)
+    if numpy is not None:
+        t = numpy.arange(n) / rate
+        samples = sum(numpy.sin(2 * numpy.pi * f * t) for f in frequencies)
+        return (samples * scale).astype('<i2').tobytes()
+    steps = [2 * math.pi * f / rate for f in frequencies]
+    samples = array('h', (
+        int(scale * sum(math.sin(step * i) for step in steps))
+        for i in range(n)))
+    if sys.byteorder != 'little':
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def note_frequency(note):
+    """MIDI note number to Hz; note 0 is a rest."""
+    if not note:
+        return ()
+    return (440 * 2 ** ((note - 69) / 12),)
+
+
+def render_tones(data, rate=SAMPLE_RATE):
+    """tonegn buffer: (note, duration in 10ms units) byte pairs."""
+    return b''.join(
+        tone(note_frequency(note), 10 * duration, rate)
+        for note, duration in zip(data[::2], data[1::2]))
+
+
+def render_dial(digits, rate=SAMPLE_RATE):
+    """DTMF for a dial string; ',' pauses and anything else is skipped."""
+    blocks = []
+    for digit in digits.upper():
+        if digit in DTMF:
+            blocks.append(tone(DTMF[digit], DIGIT_MS, rate))
+            blocks.append(tone((), GAP_MS, rate))
+        elif digit == ',':
+            blocks.append(tone((), PAUSE_MS, rate))
+    return b''.join(blocks)
+
+
+def write_wav(path, pcm, rate=SAMPLE_RATE):
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(SAMPLE_WIDTH)
+        w.setframerate(rate)
+        w.writeframes(pcm)
+
+
+class WavSink(object):
+    """Writes each rendering to its own WAV file in directory."""
+
+    def __init__(self, directory, rate=SAMPLE_RATE):
+        self.directory = directory
+        self.rate = rate
+        self.counter = count()
+
+    def write(self, name, pcm):
+        path = os.path.join(self.directory, '{}-{}-{:06d}.wav'.format(
+            name, os.getpid(), next(self.counter)))
+        write_wav(path, pcm, self.rate)
+        return path
+
+
+class StreamSink(object):
+    """Writes raw PCM from every rendering to a binary stream.
+
+    Renderings run on the task executor and can finish in any order, so
+    tasks write through a slot() taken when they are submitted; PCM that
+    arrives early is held until every earlier slot is written or closed.
+    """
+
+    def __init__(self, stream, rate=SAMPLE_RATE):
+        self.stream = stream
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._tickets = count()
+        self._next = 0
+        self._held = {}
+
+    def slot(self):
+        return StreamSlot(self, next(self._tickets))
+
+    def _put(self, ticket, pcm):
+        with self._lock:
+            self._held[ticket] = pcm
+            while self._next in self._held:
+                self.stream.write(self._held.pop(self._next))
+                self._next += 1
+
+    def write(self, name, pcm):
+        self._put(next(self._tickets), pcm)
+
+
+class StreamSlot(object):
+    """One rendering's place in a StreamSink's output."""
+
+    def __init__(self, sink, ticket):
+        self.sink = sink
+        self.ticket = ticket
+        self.rate = sink.rate
+        self.pcm = []
+        self.closed = False
+
+    def write(self, name, pcm):
+        self.pcm.append(pcm)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.sink._put(self.ticket, b''.join(self.pcm))
@@ -0,0 +1,77 @@
+import json
+import time
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from tbas.tbas import Channel, Context, Interpreter, LimitExceeded
+
+
+def run_record(line, fast=False, jit=False):
+    """Run the program in one JSONL line and return its result line.
+
+    A record is an object with a "program" and optionally "id", "input"
+    and "modem" (console and modem input), "limits" ({"steps", "depth",
+    "memory"}, see tbas.tbas.Limits; steps also bounds the program itself),
+    "expected" (console output) and "fast"/"jit" to choose the engine.
+
+    The result has "id", "output", "modem", "steps", "elapsed" (seconds),
+    "error", "limit" (the name of the limit hit, if any) and, if a record
+    has "expected", "passed".
+    """
+    result = {'id': None, 'output': '', 'modem': '', 'steps': 0,
+              'elapsed': 0.0, 'error': None, 'limit': None}
+    start = time.perf_counter()
+    ctx = expected = None
+    try:
+        record = json.loads(line)
+        result['id'] = record.get('id')
+        expected = record.get('expected')
+        tbas = Interpreter()
+        limits = record.get('limits', {})
+        for name in ('steps', 'depth', 'memory'):
+            if name in limits:
+                setattr(tbas.limits, name, limits[name])
+        # built here rather than by run_sync, so that steps and output can
+        # be reported when the run fails
+        ctx = Context(record['program'], tbas)
+        ctx.console = Channel(record.get('input', ''))
+        ctx.modem = Channel(record.get('modem', ''))
+        tbas._run_sync(ctx, record.get('fast', fast), record.get('jit', jit),
+                       limits.get('steps'))
+    except LimitExceeded as e:
+        result['error'] = str(e)
+        result['limit'] = e.limit
+    except Exception as e:
+        result['error'] = str(e) or type(e).__name__
+    result['elapsed'] = time.perf_counter() - start
+    if ctx is not None:
+        result['steps'] = ctx.steps
+        result['output'] = ctx.console.getvalue()
+        result['modem'] = ctx.modem.getvalue()
+    if expected is not None:
+        result['passed'] = (result['error'] is None and
+                            result['output'] == expected)
+    return json.dumps(result)
+
+
+def run_batch(lines, workers=1, window=None, fast=False, jit=False):
+    """Yield a result line for each record line, in order. With more than
+    one worker, records run in that many processes; at most window (by
+    default 4 per worker) are read ahead, so memory use doesn't depend on
+    how many lines there are. Blank lines are skipped.
+    """
+    lines = (line for line in lines if line.strip())
+    if workers <= 1:
+        for line in lines:
+            yield run_record(line, fast, jit)
+        return
+    window = window or 4 * workers
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for line in lines:
+            pending.append(executor.submit(run_record, line, fast, jit))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,144 @@
+import hashlib
+import sqlite3
+
+
+# Bump whenever a change to the engines changes what a program computes, so
+# results cached by older versions are never used
+ENGINE_VERSION = 1
+
+# Tasks whose only effects are on the run itself
+DETERMINISTIC_TASKS = {'tbas'}
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS results (
+    key BLOB PRIMARY KEY,
+    snapshot BLOB NOT NULL,
+    console BLOB NOT NULL,
+    modem BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+'''
+
+
+class ResultCache(object):
+    """Results of deterministic runs in an SQLite file, keyed by program,
+    console and modem input, the interpreter's limits and ENGINE_VERSION.
+    Each result is the final snapshot of the context (memory, io buffer,
+    step count) and the console and modem output. Once results take up
+    more than max_bytes, the least recently used are evicted.
+
+    The total size and the recency clock are kept in memory, and hits are
+    written back in batches of flush_every (and by put and close), so a
+    file should only be open in one ResultCache at a time.
+
+    Set it as Interpreter.cache; see Interpreter.run for when it applies.
+    """
+
+    flush_every = 256
+
+    def __init__(self, path, max_bytes=64 << 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_schema)
+        self.hits = 0
+        self.misses = 0
+        self._size, self._clock = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0), COALESCE(MAX(used), 0) '
+            'FROM results').fetchone()
+        # key -> tick of hits not yet written back
+        self._used = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    @staticmethod
+    def key(source, console=b'', modem=b'', limits=()):
+        """limits are the interpreter's (depth, steps, memory): a run that
+        succeeded under loose ones may not under tighter ones."""
+        h = hashlib.sha256()
+        for part in (str(ENGINE_VERSION).encode(), source.encode(),
+                     console, modem, repr(tuple(limits)).encode()):
+            h.update(len(part).to_bytes(8, 'little'))
+            h.update(part)
+        return h.digest()
+
+    @property
+    def size(self):
+        return self._size
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _flush(self):
+        self.db.executemany('UPDATE results SET used = ? WHERE key = ?',
+                            ((used, key) for key, used in self._used.items()))
+        self._used.clear()
+
+    def flush(self):
+        """Write back the recency of hits since the last flush."""
+        with self.db:
+            self._flush()
+
+    def get(self, key):
+        """(snapshot, console output, modem output) or None."""
+        row = self.db.execute(
+            'SELECT snapshot, console, modem FROM results WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used[key] = self._tick()
+        if len(self._used) >= self.flush_every:
+            self.flush()
+        return row
+
+    def put(self, key, snapshot, console, modem):
+        size = len(key) + len(snapshot) + len(console) + len(modem)
+        if size > self.max_bytes:
+            return
+        with self.db:
+            self._flush()
+            old = self.db.execute('SELECT size FROM results WHERE key = ?',
+                                  (key,)).fetchone()
+            self.db.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                (key, bytes(snapshot), bytes(console), bytes(modem), size,
+                 self._tick()))
+            total = self._size + size - (old[0] if old else 0)
+            self._size = self._evict(total)
+
+    def _evict(self, total):
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return total
+        rows = self.db.execute('SELECT key, size FROM results ORDER BY used')
+        evict = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            evict.append((key,))
+            excess -= size
+            total -= size
+        self.db.executemany('DELETE FROM results WHERE key = ?', evict)
+        return total
+
+    def clear(self):
+        with self.db:
+            self.db.execute('DELETE FROM results')
+        self._used.clear()
+        self._size = 0
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -1,8 +1,11 @@
 import argparse
 import asyncio
+import json
 import logging
+import os
 import sys
 
+from tbas.tasks import audio_tasks, display_tasks
 from tbas.tbas import Interpreter
 
 
@@ -15,14 +18,143 @@ async def stdio_writer(*args, **kwargs):
     return sys.stdout.write(*args, **kwargs)
 
 
-async def run_tbas(program, **kwargs):
+async def run_tbas(program, run_kwargs=None, audio=None, display=None,
+                   **kwargs):
     i = Interpreter(**kwargs)
-    future = asyncio.ensure_future(i.run(program))
+    if audio:
+        from tbas.audio import WavSink
+        i.tasks.update(audio_tasks(WavSink(audio)))
+    if display:
+        from tbas.display import FrameSink
+        i.tasks.update(display_tasks(FrameSink(display)))
+    future = asyncio.ensure_future(i.run(program, **(run_kwargs or {})))
     await future
     return future.result()
 
 
+def load(program):
+    """The program named on the command line: '-' reads it from stdin, a
+    bytecode file is loaded as a Program, any other existing path is read
+    from that file, anything else is the program itself. Comments are
+    dropped from files and stdin as they are read."""
+    from tbas.compiler import Program, is_bytecode, load_program, read_program
+    if program == '-':
+        return read_program(sys.stdin.buffer)
+    if is_bytecode(program):
+        return Program.load(program)
+    if os.path.isfile(program):
+        return load_program(program)
+    return program
+
+
+def compile_(argv):
+    from tbas.compiler import BYTECODE_SUFFIX, Program
+    p = argparse.ArgumentParser(prog='tbas compile',
+                                description='write a bytecode file')
+    p.add_argument('-o', '--output',
+                   help='defaults to the program file with a {} suffix'
+                   .format(BYTECODE_SUFFIX))
+    p.add_argument('program',
+                   help="a program, a program file, or - to read stdin")
+    args = p.parse_args(argv)
+
+    output = args.output
+    if output is None:
+        if not os.path.isfile(args.program):
+            p.error('-o is needed unless the program is a file')
+        output = os.path.splitext(args.program)[0] + BYTECODE_SUFFIX
+    program = load(args.program)
+    if not isinstance(program, Program):
+        program = Program(program)
+    program.save(output)
+    return 0
+
+
+def serve(argv):
+    from tbas.server import DEFAULT_SOCKET, MAX_STEPS, Server
+    p = argparse.ArgumentParser(prog='tbas serve',
+                                description='run programs sent to a socket')
+    p.add_argument('-s', '--socket', default=DEFAULT_SOCKET)
+    p.add_argument('-w', '--workers', type=int, default=4)
+    p.add_argument('--max-steps', type=int, default=MAX_STEPS,
+                   help='stop programs that run longer (default %(default)s)')
+    p.add_argument('-d', '--debug', action='store_true')
+    args = p.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    server = Server(args.socket, workers=args.workers,
+                    max_steps=args.max_steps)
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+def client(argv):
+    from tbas.server import DEFAULT_SOCKET, Client
+    p = argparse.ArgumentParser(prog='tbas client',
+                                description='run programs on a tbas server')
+    p.add_argument('-s', '--socket', default=DEFAULT_SOCKET)
+    p.add_argument('-i', '--input', default='', help='console input')
+    p.add_argument('--fast', action='store_true')
+    p.add_argument('--jit', action='store_true')
+    p.add_argument('-v', '--verbose', action='store_true',
+                   help='print steps and run time to stderr')
+    p.add_argument('program', nargs='*',
+                   help='programs or program files to run, one program per '
+                   'line on stdin if none')
+    args = p.parse_args(argv)
+
+    # the server compiles what it is sent, so bytecode goes as its source
+    programs = ([getattr(program, 'source', program)
+                 for program in map(load, args.program)] or
+                (line.rstrip('\n') for line in sys.stdin))
+    console = args.input.encode('latin-1')
+    failed = False
+    with Client(args.socket) as c:
+        requests = ((program, console, b'', args.fast, args.jit)
+                    for program in programs)
+        for result in c.run_many(requests):
+            if not result.ok:
+                failed = True
+                print(result.error, file=sys.stderr)
+                continue
+            print(result.console.decode('latin-1'))
+            if args.verbose:
+                print('{} steps in {:.3f}ms'.format(
+                    result.steps, result.elapsed / 1e6), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def batch(argv):
+    from tbas.batch import run_batch
+    p = argparse.ArgumentParser(
+        prog='tbas batch',
+        description='run the programs in a JSONL file, one result per line')
+    p.add_argument('-w', '--workers', type=int, default=1)
+    p.add_argument('-o', '--output', type=argparse.FileType('w'),
+                   default=sys.stdout)
+    p.add_argument('--fast', action='store_true')
+    p.add_argument('--jit', action='store_true')
+    p.add_argument('input', nargs='?', type=argparse.FileType('r'),
+                   default=sys.stdin, help='JSONL records, stdin if omitted')
+    args = p.parse_args(argv)
+
+    failed = False
+    for line in run_batch(args.input, args.workers, fast=args.fast,
+                          jit=args.jit):
+        failed = failed or json.loads(line).get('passed') is False
+        args.output.write(line + '\n')
+    return 1 if failed else 0
+
+
 def main():
+    commands = {'serve': serve, 'client': client, 'batch': batch,
+                'compile': compile_}
+    if sys.argv[1:2] and sys.argv[1] in commands:
+        sys.exit(commands[sys.argv[1]](sys.argv[2:]))
+
     p = argparse.ArgumentParser(description='tbas')
  
     m = p.add_mutually_exclusive_group()
@@ -30,14 +162,32 @@ def main():
     m.add_argument('-m', action='store_true', help='attach modem to STD*')
     p.add_argument('-d', '--debug', action='store_true')
     p.add_argument('-f', type=int, help='print contents of frame')
+    p.add_argument('-t', '--trace', help='write a trace file')
+    p.add_argument('-r', '--record', help='write a session file for replay')
+    p.add_argument('-a', '--audio', help='write task audio to WAV files here')
+    p.add_argument('-b', '--display', help='write task display frames here')
 
-    p.add_argument('program')
+    p.add_argument('program',
+                   help="a program, a program file, or - to read stdin")
     args = p.parse_args()
 
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
 
     kwargs = {}
+    run_kwargs = {}
+
+    if args.trace:
+        run_kwargs['trace'] = args.trace
+
+    if args.record:
+        run_kwargs['record'] = args.record
+
+    if args.audio:
+        kwargs['audio'] = args.audio
+
+    if args.display:
+        kwargs['display'] = args.display
 
     if args.c:
         kwargs.update({
@@ -52,11 +202,16 @@ def main():
             })
 
     loop = asyncio.get_event_loop()
-    context = loop.run_until_complete(run_tbas(args.program, **kwargs))
+    context = loop.run_until_complete(
+        run_tbas(load(args.program), run_kwargs, **kwargs))
     print("\n")
 
     if args.f:
-        print(context.stack[args.f].format_mcell('03d'))
+        stack = context.stack
+        if args.trace:
+            from tbas.trace import TraceReader
+            stack = TraceReader(args.trace)
+        print(stack[args.f].format_mcell('03d'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,194 @@
+import mmap
+import os
+import struct
+import sys
+
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+
+
+OPERATORS = '><+-[]=?'
+FOLDABLE = '><+-'
+
+# every byte that isn't an operator, i.e. comments
+COMMENTS = bytes(b for b in range(256) if chr(b) not in OPERATORS)
+# files at least this big are memory mapped rather than read
+MMAP_THRESHOLD = 1 << 20
+CHUNK = 1 << 20
+
+BYTECODE_MAGIC = b'TBbc'
+BYTECODE_VERSION = 1
+BYTECODE_SUFFIX = '.tbc'
+
+# magic, version, len(code), len(source) in bytes, n_folded. Then
+# positions, runs and jumps as little endian 32 bit arrays, code, and
+# source in utf-8; the arrays stay 4 byte aligned.
+_bytecode_header = struct.Struct('<4sHxxIII')
+
+
+class Program(object):
+    """A TBAS program stripped of comments, with runs folded and loops
+    matched. `positions` maps each instruction back to its offset in
+    `source`, so everything user-facing can keep talking in source eptrs.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        if source.isascii() and len(strip_comments(
+                source.encode('ascii'))) == len(source):
+            # nothing to strip, e.g. a program from load_program
+            self.positions = array('I', range(len(source)))
+            self.code = source
+        else:
+            self.positions = array('I', (
+                i for i, c in enumerate(source) if c in OPERATORS))
+            self.code = ''.join(source[i] for i in self.positions)
+        self.runs = self._fold(self.code)
+        self.jumps = self._match(self.code)
+        # compiled hot loops by '[' index, None if they can't be compiled
+        self.loops = {}
+        self._n_folded = None
+
+    def __len__(self):
+        return len(self.code)
+
+    def __repr__(self):
+        return '<Program {} instructions>'.format(len(self))
+
+    @staticmethod
+    def _fold(code):
+        # runs[i] is the length of the run of identical operators from i on
+        runs = array('I', [1]) * len(code)
+        for i in range(len(code) - 2, -1, -1):
+            if code[i] in FOLDABLE and code[i] == code[i + 1]:
+                runs[i] = runs[i + 1] + 1
+        return runs
+
+    @staticmethod
+    def _match(code):
+        # jumps[i] is the index of the matching bracket, -1 if unmatched
+        jumps = array('i', [-1]) * len(code)
+        opened = []
+        for i, c in enumerate(code):
+            if c == '[':
+                opened.append(i)
+            elif c == ']' and opened:
+                j = opened.pop()
+                jumps[i], jumps[j] = j, i
+        return jumps
+
+    @property
+    def n_folded(self):
+        """Number of instructions once runs are folded."""
+        if self._n_folded is None:
+            code = self.code
+            self._n_folded = sum(
+                1 for i, c in enumerate(code)
+                if not (i and c in FOLDABLE and c == code[i - 1]))
+        return self._n_folded
+
+    @property
+    def unmatched(self):
+        """Source offsets of brackets without a partner."""
+        return [self.positions[i] for i, c in enumerate(self.code)
+                if c in '[]' and self.jumps[i] < 0]
+
+    def eptr(self, index):
+        if index < len(self.positions):
+            return self.positions[index]
+        return len(self.source)
+
+    def index(self, eptr):
+        return bisect_left(self.positions, eptr)
+
+    def save(self, path):
+        """Write the compiled program to a bytecode (.tbc) file."""
+        arrays = []
+        for values, typecode in ((self.positions, 'I'), (self.runs, 'I'),
+                                 (self.jumps, 'i')):
+            values = array(typecode, values)
+            if sys.byteorder != 'little':
+                values.byteswap()
+            arrays.append(values.tobytes())
+        source = self.source.encode()
+        with open(path, 'wb') as f:
+            f.write(_bytecode_header.pack(
+                BYTECODE_MAGIC, BYTECODE_VERSION, len(self.code),
+                len(source), self.n_folded))
+            f.write(b''.join(arrays))
+            f.write(self.code.encode('ascii'))
+            f.write(source)
+
+    @classmethod
+    def load(cls, path):
+        """Read a program written by save(). The position map, runs and
+        jumps are views onto the memory mapped file rather than copies."""
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(data)
+        magic, version, n, n_source, n_folded = \
+            _bytecode_header.unpack_from(view)
+        if magic != BYTECODE_MAGIC or version != BYTECODE_VERSION:
+            raise ValueError('Not a version {} bytecode file'.format(
+                BYTECODE_VERSION))
+        offset = _bytecode_header.size
+        columns = []
+        for typecode in 'IIi':
+            column = view[offset:offset + 4 * n].cast('B').cast(typecode)
+            if sys.byteorder != 'little':
+                column = array(typecode, column)
+                column.byteswap()
+            columns.append(column)
+            offset += 4 * n
+        program = cls.__new__(cls)
+        program.positions, program.runs, program.jumps = columns
+        program.code = str(view[offset:offset + n], 'ascii')
+        offset += n
+        program.source = str(view[offset:offset + n_source], 'utf-8')
+        program.loops = {}
+        program._n_folded = n_folded
+        return program
+
+
+def strip_comments(data):
+    """The operators in data, a bytes-like object, as bytes."""
+    return bytes(data).translate(None, COMMENTS)
+
+
+def read_program(file, chunk=CHUNK):
+    """Read a program from a binary file object a chunk at a time, dropping
+    comments as it goes, so only the operators are ever held whole."""
+    code = bytearray()
+    while True:
+        data = file.read(chunk)
+        if not data:
+            break
+        code += data.translate(None, COMMENTS)
+    return code.decode('ascii')
+
+
+def load_program(path, chunk=CHUNK):
+    """Read a program file without its comments. Files of MMAP_THRESHOLD
+    bytes or more are memory mapped and stripped a chunk at a time."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return read_program(f, chunk)
+        code = bytearray()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for offset in range(0, size, chunk):
+                code += m[offset:offset + chunk].translate(None, COMMENTS)
+        return code.decode('ascii')
+
+
+def is_bytecode(program):
+    """Whether program names a bytecode file rather than being a program."""
+    return (isinstance(program, (str, os.PathLike)) and
+            os.fspath(program).endswith(BYTECODE_SUFFIX) and
+            os.path.isfile(program))
+
+
+@lru_cache(maxsize=256)
+def compile_program(source):
+    return Program(source)
@@ -0,0 +1,10 @@
+import asyncio
+
+
+def run(coro):
+    """Run coro to completion on a new event loop, then close the loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
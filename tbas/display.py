@@ -0,0 +1,142 @@
+import os
+import struct
+
+from functools import lru_cache
+from itertools import count, islice
+
+
+# A frame is one byte per column, bit 0 at the top
+WIDTH = 32
+HEIGHT = 8
+
+FRAMES_MAGIC = b'TBfb'
+FRAMES_VERSION = 1
+# magic, version, width, height, frames
+_frames_header = struct.Struct('<4sBHHI')
+
+# 5x7 columns for ' ' to '~'
+FONT = bytes.fromhex('''
+    0000000000 00005f0000 0007000700 147f147f14 242a7f2a12 2313086462
+    3649552250 0005030000 001c224100 0041221c00 082a1c2a08 08083e0808
+    0050300000 0808080808 0060600000 2010080402 3e5149453e 00427f4000
+    4261514946 2141454b31 1814127f10 2745454539 3c4a494930 0171090503
+    3649494936 064949291e 0036360000 0056360000 0814224100 1414141414
+    0041221408 0201510906 324979413e 7e1111117e 7f49494936 3e41414122
+    7f4141221c 7f49494941 7f09090101 3e41415132 7f0808087f 00417f4100
+    2040413f01 7f08142241 7f40404040 7f0204027f 7f0408107f 3e4141413e
+    7f09090906 3e4151215e 7f09192946 4649494931 01017f0101 3f4040403f
+    1f2040201f 7f2018207f 6314081463 0304780403 6151494543 00007f4141
+    0204081020 41417f0000 0402010204 4040404040 0001020400 2054545478
+    7f48444438 3844444420 384444487f 3854545418 087e090102 081454543c
+    7f08040478 00447d4000 2040443d00 007f102844 00417f4000 7c0418047c
+    7c08040478 3844444438 7c14141408 081414187c 7c08040408 4854545420
+    043f444020 3c4040207c 1c2040201c 3c4030403c 4428102844 0c5050503c
+    4464544c44 0008364100 00007f0000 0041360800 0201020402
+    ''')
+
+
+@lru_cache(maxsize=None)
+def glyph(char):
+    """Columns for char plus one blank column; unknown chars render '?'."""
+    code = ord(char)
+    if not 32 <= code < 127:
+        code = ord('?')
+    offset = (code - 32) * 5
+    return FONT[offset:offset + 5] + b'\0'
+
+
+def raster(text, blanks=0):
+    return b'\0' * blanks + b''.join(glyph(c) for c in text) + b'\0' * blanks
+
+
+def scroll_frames(text, ppong=0, steps=1, blanks=0, width=WIDTH):
+    """Frames scrolling text across the display by steps columns each,
+    with blanks empty columns either side. With ppong it scrolls back
+    again afterwards."""
+    columns = raster(text, blanks).ljust(width, b'\0')
+    offsets = list(range(0, len(columns) - width + 1, max(steps, 1)))
+    if ppong:
+        offsets += offsets[-2:0:-1]
+    for offset in offsets:
+        yield columns[offset:offset + width]
+
+
+def blinken_frames(part, pos, mask, vel, vel_delay, lfo, lfo_delay,
+                   width=WIDTH):
+    """An endless stream of frames for a blinken pattern: part + 1
+    columns of mask starting at column pos. The block moves vel columns
+    (a signed byte) every vel_delay + 1 frames, wrapping around. If lfo is
+    set it blinks, lfo frames on and lfo off, after the first lfo_delay
+    frames."""
+    if vel > 127:
+        vel -= 256
+    block = bytes([mask]) * min(part + 1, width)
+    for i in count():
+        frame = bytearray(width)
+        lit = not lfo or i < lfo_delay or not (i - lfo_delay) // lfo % 2
+        if lit:
+            start = pos + vel * (i // (vel_delay + 1))
+            for j, column in enumerate(block):
+                frame[(start + j) % width] = column
+        yield bytes(frame)
+
+
+def format_frame(frame, height=HEIGHT):
+    return '\n'.join(
+        ''.join('#' if column >> row & 1 else '.' for column in frame)
+        for row in range(height))
+
+
+def write_frames(path, frames, width=WIDTH, height=HEIGHT):
+    """Write frames to a compact frame file; returns the number written."""
+    n = 0
+    with open(path, 'wb') as f:
+        f.write(_frames_header.pack(FRAMES_MAGIC, FRAMES_VERSION, 0, 0, 0))
+        for frame in frames:
+            f.write(frame)
+            n += 1
+        f.seek(0)
+        f.write(_frames_header.pack(
+            FRAMES_MAGIC, FRAMES_VERSION, width, height, n))
+    return n
+
+
+def read_frames(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, width, height, n = _frames_header.unpack_from(data)
+    if magic != FRAMES_MAGIC or version != FRAMES_VERSION:
+        raise ValueError('Not a version {} frame file'.format(FRAMES_VERSION))
+    offset = _frames_header.size
+    return [data[offset + i * width:offset + (i + 1) * width]
+            for i in range(n)]
+
+
+def write_gif(path, frames, height=HEIGHT, scale=4, duration=100):
+    """Write frames as an animated GIF. Needs Pillow."""
+    from PIL import Image
+    images = []
+    for frame in frames:
+        image = Image.new('1', (len(frame), height))
+        image.putdata([255 * (frame[x] >> y & 1)
+                       for y in range(height) for x in range(len(frame))])
+        images.append(image.resize(
+            (len(frame) * scale, height * scale), Image.NEAREST))
+    images[0].save(path, save_all=True, append_images=images[1:],
+                   duration=duration, loop=0)
+
+
+class FrameSink(object):
+    """Writes each task's frames to its own frame file in directory.
+    Endless streams are cut off after limit frames."""
+
+    def __init__(self, directory, limit=256):
+        self.directory = directory
+        self.limit = limit
+        self.counter = count()
+
+    def write(self, name, frames):
+        path = os.path.join(self.directory, '{}-{}-{:06d}.tbf'.format(
+            name, os.getpid(), next(self.counter)))
+        write_frames(path, islice(frames, self.limit))
+        return path
@@ -1,15 +1,26 @@
+import time
+# before the Qt imports below, which are most of the startup time that
+# --startup-time reports
+_import_started = time.perf_counter()
+
 import asyncio
+import collections
 import logging
 import os
 import sys
 
+from functools import partial
+from itertools import zip_longest
+
 from PyQt5 import QtCore, QtGui, QtWidgets
-from PyQt5.QtCore import pyqtSignal, Qt, QUrl, QMetaObject, Q_ARG, QVariant
+from PyQt5.QtCore import Qt, QUrl, QMetaObject
 from PyQt5.QtWidgets import QApplication, QMainWindow
 from quamash import QEventLoop, QThreadExecutor
 
-from tbas.tbas import Interpreter
+from tbas.compiler import OPERATORS, Program
+from tbas.tbas import Context, Interpreter, WORKING_MEMORY_BYTES, byte_strings
 from tbas.mainwindow import Ui_MainWindow
+from tbas.worker import RunWorker, threadsafe
 
 
 def resource_path(filename):
@@ -20,17 +31,170 @@ def resource_path(filename):
 
 
 class TBASLogHandler(logging.Handler):
-    def __init__(self, widget):
+    """Keeps records in a ring buffer; drain() writes whatever has
+    accumulated to the widget in one append and is called on a timer.
+    Records may be emitted from any thread. If operator is given, it's
+    called to tag each record with the operator being evaluated, and only
+    records for the operators in self.operators are kept.
+    """
+    def __init__(self, widget, capacity=5000, operator=None):
         super().__init__()
         self.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
         self.widget = widget
+        self.widget.document().setMaximumBlockCount(capacity)
+        self.records = collections.deque(maxlen=capacity)
+        self.dropped = 0
+        self.operator = operator
+        self.operators = None
+
+    def emit(self, record):
+        if self.operators and self.operator:
+            if self.operator() not in self.operators:
+                return
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(record)
+
+    def drain(self):
+        records = []
+        while self.records:
+            records.append(self.records.popleft())
+        lines = [self.format(record) for record in records]
+        if self.dropped:
+            lines.insert(0, '... {} records dropped'.format(self.dropped))
+            self.dropped = 0
+        if lines:
+            self.widget.append('\n'.join(lines))
+
+
+
+class TBASHighlighter(QtGui.QSyntaxHighlighter):
+    """Greys out characters that aren't operators and marks the brackets
+    the last analysis found unmatched (source offsets in self.unmatched)."""
+    def __init__(self, document):
+        super().__init__(document)
+        self.unmatched = set()
+        self.ignored_format = QtGui.QTextCharFormat()
+        self.ignored_format.setForeground(QtGui.QColor('#9a9a9a'))
+        self.unmatched_format = QtGui.QTextCharFormat()
+        self.unmatched_format.setBackground(QtGui.QColor('#ff8c8c'))
+
+    def highlightBlock(self, text):
+        start = self.currentBlock().position()
+        for i, c in enumerate(text):
+            if c not in OPERATORS:
+                if not c.isspace():
+                    self.setFormat(i, 1, self.ignored_format)
+            elif start + i in self.unmatched:
+                self.setFormat(i, 1, self.unmatched_format)
+
+
+class IOPane(object):
+    """Coalesces console or modem traffic for a text widget. Consecutive
+    writes with the same prefix and counter become one line, and the
+    widget is only touched when flush() is called on a timer. Input echoes
+    go through the same queue so they stay in order.
+    """
+    def __init__(self, widget, capacity=1000):
+        self.widget = widget
+        self.widget.document().setMaximumBlockCount(capacity)
+        self.pending = []
+        self.open_line = None
 
-    def emit(self, message):
-        self.widget.append(self.format(message))
+    def write(self, isoutput, counter, value):
+        prefix = "Out" if isoutput else "In "
+        # only output runs on; each input is its own line
+        if isoutput and self.pending and self.pending[-1][:2] == [
+                prefix, counter]:
+            self.pending[-1][2] += value
+        else:
+            self.pending.append([prefix, counter, value])
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        prefix, counter, value = pending[0]
+        if self.open_line == (prefix, counter) and prefix == "Out":
+            cursor = self.widget.textCursor()
+            cursor.movePosition(QtGui.QTextCursor.End)
+            cursor.insertText(value)
+            pending.pop(0)
+        if pending:
+            self.widget.append("\n".join(
+                "{}[{}]: {}".format(*line) for line in pending))
+            self.open_line = tuple(pending[-1][:2])
+        self.widget.ensureCursorVisible()
+
+
+class ByteTableModel(QtCore.QAbstractTableModel):
+    """Sixteen bytes a row, with the byte at pointer highlighted. set_values
+    only signals the cells that differ from the previous values, so the
+    view repaints just those."""
+    columns = 16
+    pointer_brush = QtGui.QBrush(QtGui.QColor('#a6c8f4'))
+
+    def __init__(self, parent=None, format='03d'):
+        super().__init__(parent)
+        self.values = []
+        self.pointer = None
+        self.strings = byte_strings(format)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return (len(self.values) + self.columns - 1) // self.columns
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return self.columns
+
+    def data(self, index, role=Qt.DisplayRole):
+        i = index.row() * self.columns + index.column()
+        if i >= len(self.values):
+            return None
+        if role == Qt.DisplayRole:
+            return self.strings[self.values[i]]
+        if role == Qt.BackgroundRole and i == self.pointer:
+            return self.pointer_brush
+        return None
 
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Vertical:
+            return '0x{:03x}'.format(section * self.columns)
+        return '{:x}'.format(section)
+
+    def _cell_changed(self, i):
+        index = self.index(i // self.columns, i % self.columns)
+        self.dataChanged.emit(index, index)
+
+    def set_format(self, format):
+        self.strings = byte_strings(format)
+        if self.values:
+            self.dataChanged.emit(
+                self.index(0, 0),
+                self.index(self.rowCount() - 1, self.columns - 1))
+
+    def set_values(self, values, pointer=None):
+        old_values, old_pointer = self.values, self.pointer
+        if self.rowCount() != (len(values) + self.columns - 1) // self.columns:
+            self.beginResetModel()
+            self.values, self.pointer = values, pointer
+            self.endResetModel()
+            return
+        self.values, self.pointer = values, pointer
+        for i, (a, b) in enumerate(zip_longest(old_values, values)):
+            if a != b:
+                self._cell_changed(i)
+        if pointer != old_pointer:
+            for i in [old_pointer, pointer]:
+                if i is not None and 0 <= i < len(values):
+                    self._cell_changed(i)
 
 
 class TBASMainWindow(QMainWindow, Ui_MainWindow):
+    # memory_select and buffer_select: Ascii, Hex, Int
+    byte_formats = ['c', '02x', '03d']
+
     connected_signals = ['clicked', 'currentIndexChanged',
         'cursorPositionChanged', 'returnPressed', 'selectionChanged',
         'sliderMoved', 'stateChanged', 'textChanged', 'textEdited',
@@ -51,55 +215,90 @@ class TBASMainWindow(QMainWindow, Ui_MainWindow):
         self.setupUi(self)
         self.setWindowTitle('tbas-ide')
 
-        # Setup the busy indicators
-        for w in [self.console_blocked, self.modem_blocked]:
-            w.setSource(QUrl(resource_path('BusyIndicator.qml')))
-            w.setClearColor(Qt.transparent)
-            layout = QtWidgets.QVBoxLayout(w)
-            layout.setContentsMargins(0, 0, 0, 0)
-            QMetaObject.invokeMethod(w.rootObject(), "stop")
+        # the QML busy indicators are only loaded once something blocks
+        self.busy_indicators = {}
 
         # connect all of the signals 
-        for method in self.__dir__():
+        for method in vars(TBASMainWindow):
             if method.count('_') and not method.startswith('_'):
                 emitter_name, _, signal_name = method.rpartition('_')
                 if signal_name in self.connected_signals:
                     signal = getattr(getattr(self, emitter_name), signal_name)
                     signal.connect(getattr(self, method))
 
+        # memory and io buffer are table views over the current frame
+        self.memory_model = ByteTableModel(self)
+        self.memory_view = self.replace_with_table(
+            self.memory_buffer, self.memory_model)
+        self.io_model = ByteTableModel(self)
+        self.io_view = self.replace_with_table(self.io_buffer, self.io_model)
+        self.memory_select_currentIndexChanged(
+            self.memory_select.currentIndex())
+        self.buffer_select_currentIndexChanged(
+            self.buffer_select.currentIndex())
+
         # start clean
         self.program_input_is_dirty = False
+        self.breakpoints = set()
+        self.current_context = None
+
+        # edits are compiled in the background once typing pauses
+        self.highlighter = TBASHighlighter(self.program_input.document())
+        self.analysis_executor = QThreadExecutor(1)
+        self.analysis_timer = QtCore.QTimer(self)
+        self.analysis_timer.setSingleShot(True)
+        self.analysis_timer.setInterval(300)
+        self.analysis_timer.timeout.connect(self.analyze_program)
+        # (text, Program) of the last analysis, run as is if still current
+        self.analysed = None
+
+        # F9 toggles a breakpoint at the cursor
+        self.breakpoint_shortcut = QtWidgets.QShortcut(
+            QtGui.QKeySequence('F9'), self.program_input)
+        self.breakpoint_shortcut.activated.connect(self.toggle_breakpoint)
 
         # setup the mainloop and tie it to asyncio
         self.main_loop = QEventLoop(self)
         asyncio.set_event_loop(self.main_loop)
 
+        # programs run on a worker thread, polled about 60 times a second
+        self.worker = None
+        # a cancelled worker that hadn't stopped when it was let go
+        self.stopping = None
+        self.frames_seen = 0
+        self.worker_timer = QtCore.QTimer(self)
+        self.worker_timer.setInterval(16)
+        self.worker_timer.timeout.connect(self.poll_worker)
+        self.cancel_shortcut = QtWidgets.QShortcut(
+            QtGui.QKeySequence('Esc'), self)
+        self.cancel_shortcut.activated.connect(self.tbas_cancel)
+
         # Setup TBAS interpreter
         self.reset_tbas()
-        self.tbas.logger.addHandler(TBASLogHandler(self.log_buffer))
-        self.set_log_level()
 
-        # TODO: these buttons don't do anything
-        self.run_step_button.setEnabled(False)
-        self.run_to_breakpoint_button.setEnabled(False)
-        self.run_to_end_button.setEnabled(False)
-        self.reset_button.setEnabled(False)
-        self.reset_run_step_button.setEnabled(False)
-        self.reset_run_to_breakpoint_button.setEnabled(False)
-        self.remove_breakpoints_button.setEnabled(False)
-
-        self.buffer_address.setEnabled(False)
-        self.buffer_input.setEnabled(False)
-        self.buffer_equal_button.setEnabled(False)
-        self.buffer_zero_button.setEnabled(False)
-        self.buffer_zero_all_button.setEnabled(False)
-
-        self.memory_address.setEnabled(False)
-        self.memory_input.setEnabled(False)
-        self.memory_equal_button.setEnabled(False)
-        self.memory_zero_button.setEnabled(False)
-        self.memory_zero_all_button.setEnabled(False)
+        # logging is set up the first time the log tab is used
+        self.log_handler = None
+        self.outputs_tabs.currentChanged.connect(self.outputs_tab_changed)
+        self.outputs_tab_changed(self.outputs_tabs.currentIndex())
+
+        self.console_pane = IOPane(self.console_output)
+        self.modem_pane = IOPane(self.modem_output)
+        self.io_timer = QtCore.QTimer(self)
+        self.io_timer.setInterval(33)
+        self.io_timer.timeout.connect(self.console_pane.flush)
+        self.io_timer.timeout.connect(self.modem_pane.flush)
+        self.io_timer.start()
+
+        # the memory and buffer panels set watchpoints
+        self.memory_address.setMaximum(WORKING_MEMORY_BYTES - 1)
+        self.memory_address.setToolTip('Watch mcell address')
+        self.memory_input.setToolTip('Stop when the cell becomes this value '
+                                     '(blank: on any change)')
+        self.buffer_address.setMaximum(0xffff)
+        self.buffer_address.setToolTip('Stop when icell reaches this length')
+        self.buffer_input.setToolTip('Stop when imode is set to this value')
 
+        # TODO: these buttons don't do anything
         self.console_enable.setEnabled(False)
         self.modem_enable.setEnabled(False)
 
@@ -111,10 +310,11 @@ class TBASMainWindow(QMainWindow, Ui_MainWindow):
     async def _console_read(self, *args, **kwargs):
         self.set_console_blocking()
         self.io_counter += 1
-        self._future_console_input = asyncio.Future()
-        await self._future_console_input
+        future = self._future_console_input = asyncio.Future()
+        await future
+        self._future_console_input = None
         self.set_console_blocking(False)
-        return self._future_console_input.result()
+        return future.result()
 
     async def _console_write(self, value):
         self.append_console_output(1, value)
@@ -123,55 +323,168 @@ class TBASMainWindow(QMainWindow, Ui_MainWindow):
     async def _modem_read(self, *args, **kwargs):
         self.set_modem_blocking()
         self.io_counter += 1
-        self._future_modem_input = asyncio.Future()
-        await self._future_modem_input
+        future = self._future_modem_input = asyncio.Future()
+        await future
+        self._future_modem_input = None
         self.set_modem_blocking(False)
-        return self._future_modem_input.result()
+        return future.result()
 
     async def _modem_write(self, value):
         self.append_modem_output(1, value)
 
 
     def reset_tbas(self):
+        # the interpreter runs on a worker thread; I/O is bounced back to
+        # the UI's loop, without waiting on writes
         self.tbas = Interpreter(
-            console_read = self._console_read,
-            console_write = self._console_write,
-            modem_read = self._modem_read,
-            modem_write = self._modem_write,
+            console_read = threadsafe(self._console_read, self.main_loop),
+            console_write = threadsafe(
+                self._console_write, self.main_loop, wait=False),
+            modem_read = threadsafe(self._modem_read, self.main_loop),
+            modem_write = threadsafe(
+                self._modem_write, self.main_loop, wait=False),
             )
         self.io_counter = 0
         self._future_console_input = None
         self._future_modem_input = None
-        self._tbas_future = None
         self.tbas_evaluate_program()
 
 
-    def tbas_complete_callback(self, task):
-        self._tbas_future = None
-        self.current_context = task.result()
+    def tbas_complete(self):
         self.program_input.setEnabled(True)
         self.io_counter = 0
+        if self.current_context.finished:
+            self.tbas.run_counter += 1
         self.set_stack_depth()
+        if self.current_context.watch_hit:
+            self.statusbar.showMessage('Watchpoint {} @{}'.format(
+                self.current_context.watch_hit, self.current_context.eptr))
+        else:
+            self.statusbar.showMessage('{} steps'.format(
+                self.current_context.steps))
 
     def tbas_evaluate_program(self):
-        if self._tbas_future:
-            print('FIXME')
-            return
-        self.program_input.setEnabled(False)
+        self.tbas_cancel()
+        self.tbas_load_program()
+        self.tbas_start('run')
+
+    def tbas_load_program(self):
         program = self.program_input.toPlainText()
-        self._tbas_future = asyncio.ensure_future(self.tbas.run(program.strip()))
-        self._tbas_future.add_done_callback(self.tbas_complete_callback)
+        if self.analysed is not None and self.analysed[0] == program:
+            program = self.analysed[1]
+        self.current_context = Context(program, self.tbas)
+        self.current_context.breakpoints = self.breakpoints
+        self.program_input_set_clean()
+
+    def tbas_start(self, method, *args):
+        self.tbas_cancel()
+        if self.stopping is not None:
+            if not self.stopping.done.is_set():
+                # never two workers on one context
+                self.statusbar.showMessage('Still stopping the last run')
+                return
+            self.stopping = None
+        self.program_input.setEnabled(False)
+        self.worker = RunWorker(self.current_context, method, *args)
+        self.worker.start()
+        self.worker_timer.start()
+
+    def tbas_cancel(self):
+        worker = self.worker
+        if worker is None:
+            return
+        worker.cancel()
+        self.worker = None
+        self.worker_timer.stop()
+        if self._future_console_input:
+            self._future_console_input.cancel()
+            self._future_console_input = None
+            self.set_console_blocking(False)
+        if self._future_modem_input:
+            self._future_modem_input.cancel()
+            self._future_modem_input = None
+            self.set_modem_blocking(False)
+        # the worker only sees the cancel at its next yield, up to a
+        # fast-forward budget away. Only wait briefly rather than join,
+        # in case it is waiting on this thread; tbas_start won't start
+        # another until it is done
+        if not worker.done.wait(0.5):
+            self.stopping = worker
+        self.program_input.setEnabled(True)
+        self.statusbar.showMessage('Cancelled')
+
+    def poll_worker(self):
+        worker = self.worker
+        if worker is None:
+            self.worker_timer.stop()
+        elif worker.done.is_set():
+            self.worker = None
+            self.worker_timer.stop()
+            self.tbas_complete()
+        else:
+            # one batch per tick: only the newest frame is drawn
+            if self.frames_seen != self.frame_count():
+                self.set_stack_depth()
+            self.statusbar.showMessage('Running: {} steps'.format(
+                worker.steps))
+
+    def tbas_resume_program(self, method, *args):
+        if self.worker:
+            return
+        if (self.current_context is None or self.current_context.finished
+                or self.program_input_is_dirty):
+            self.tbas_cancel()
+            self.tbas_load_program()
+        self.tbas_start(method, *args)
+
+    def toggle_breakpoint(self):
+        eptr = self.program_input.textCursor().position()
+        if eptr in self.breakpoints:
+            self.breakpoints.discard(eptr)
+        else:
+            self.breakpoints.add(eptr)
+        self.show_breakpoints()
+
+    def show_breakpoints(self):
+        selections = []
+        for eptr in sorted(self.breakpoints):
+            selection = QtWidgets.QTextEdit.ExtraSelection()
+            selection.format.setBackground(QtGui.QColor('#f4a6a6'))
+            selection.cursor = self.program_input.textCursor()
+            selection.cursor.setPosition(eptr)
+            selection.cursor.setPosition(eptr + 1, QtGui.QTextCursor.KeepAnchor)
+            selections.append(selection)
+        self.program_input.setExtraSelections(selections)
+
+    def replace_with_table(self, widget, model):
+        view = QtWidgets.QTableView(widget.parentWidget())
+        view.setModel(model)
+        view.setFont(widget.font())
+        view.setShowGrid(False)
+        view.horizontalHeader().setSectionResizeMode(
+            QtWidgets.QHeaderView.ResizeToContents)
+        view.verticalHeader().setSectionResizeMode(
+            QtWidgets.QHeaderView.ResizeToContents)
+        widget.parentWidget().layout().replaceWidget(widget, view)
+        widget.hide()
+        return view
 
     def _set_status_item(self, n, value):
             cell = self.status_table.item(n, 1)
             cell.setText(str(value))        
 
+    def frame_count(self):
+        # frames run so far, including any a FrameRing has dropped
+        stack = self.current_context.stack
+        return getattr(stack, 'dropped', 0) + len(stack)
+
     def set_stack_depth(self):
         stack_depth = len(self.current_context.stack)
         stack_max = max(stack_depth - 1, 0)
+        self.frames_seen = self.frame_count()
         self.frame_slider.setValue(0)
         self.frame_slider.setMaximum(stack_max)
-        self._set_status_item(1, stack_max)
+        self._set_status_item(1, max(self.frames_seen - 1, 0))
 
         # NOTE: will trigger a call to view_stack_position
         self.frame_slider.setValue(stack_max)
@@ -184,20 +497,21 @@ class TBASMainWindow(QMainWindow, Ui_MainWindow):
             for item in self.status_table_rows:
                 i += 1
                 self._set_status_item(i, None)
-            self.memory_buffer.setPlainText("")
-            self.io_buffer.setPlainText("")
+            self.memory_model.set_values([])
+            self.io_model.set_values(bytearray())
             return
 
-        self._set_status_item(0, stack_pointer)
+        self._set_status_item(0, getattr(stack, 'dropped', 0) + stack_pointer)
         frame = stack[stack_pointer]
 
         for item in self.status_table_rows:
             i += 1
             self._set_status_item(i, getattr(frame, item))
 
-        # TODO: enable different formatting specifications
-        self.memory_buffer.setText(frame.format_mcell('03d'))
-        self.io_buffer.setText(frame.format_icell('03d'))
+        self.memory_model.set_values(frame.mcell, frame.mptr)
+        self.io_model.set_values(frame.icell, len(frame.icell) - 1)
+        self.memory_view.scrollTo(self.memory_model.index(
+            frame.mptr // ByteTableModel.columns, 0))
 
         # hilight the selected instruction
         cursor = self.program_input.textCursor()
@@ -205,23 +519,38 @@ class TBASMainWindow(QMainWindow, Ui_MainWindow):
         cursor.setPosition(frame.eptr + 1, QtGui.QTextCursor.KeepAnchor)
         self.program_input.setTextCursor(cursor)
 
-        # TODO: hilight mptr and iptr
+    def busy_indicator(self, placeholder):
+        if placeholder not in self.busy_indicators:
+            from PyQt5 import QtQuickWidgets
+            w = QtQuickWidgets.QQuickWidget(placeholder)
+            w.setSource(QUrl(resource_path('BusyIndicator.qml')))
+            w.setClearColor(Qt.transparent)
+            layout = QtWidgets.QVBoxLayout(placeholder)
+            layout.setContentsMargins(0, 0, 0, 0)
+            layout.addWidget(w)
+            self.busy_indicators[placeholder] = w
+        return self.busy_indicators[placeholder]
 
     def set_console_blocking(self, truth=True):
         arg = "start" if truth else "stop"
         self.inputs_tabs.setCurrentIndex(0)
-        QMetaObject.invokeMethod(self.console_blocked.rootObject(), arg)
+        if truth or self.console_blocked in self.busy_indicators:
+            indicator = self.busy_indicator(self.console_blocked)
+            QMetaObject.invokeMethod(indicator.rootObject(), arg)
 
     def set_modem_blocking(self, truth=True):
         arg = "start" if truth else "stop"
         self.inputs_tabs.setCurrentIndex(1)
-        QMetaObject.invokeMethod(self.modem_blocked.rootObject(), arg)
+        if truth or self.modem_blocked in self.busy_indicators:
+            indicator = self.busy_indicator(self.modem_blocked)
+            QMetaObject.invokeMethod(indicator.rootObject(), arg)
+
 
+    def io_counter_label(self):
+        return "{}.{}".format(self.tbas.run_counter, self.io_counter)
 
     def append_console_output(self, isoutput, value):
-        prefix = "Out" if isoutput else "In "
-        self.console_output.append("{}[{}.{}]: {}".format(prefix,
-            self.tbas.run_counter, self.io_counter, value))
+        self.console_pane.write(isoutput, self.io_counter_label(), value)
 
     def cast_console_input(self):
         input_ = self.console_input.text()
@@ -243,9 +572,7 @@ class TBASMainWindow(QMainWindow, Ui_MainWindow):
 
     # TOOD: such wet copypasta!
     def append_modem_output(self, isoutput, value):
-        prefix = "Out" if isoutput else "In "
-        self.modem_output.append("{}[{}.{}]: {}".format(prefix,
-            self.tbas.run_counter, self.io_counter, value))
+        self.modem_pane.write(isoutput, self.io_counter_label(), value)
 
     def cast_modem_input(self):
         input_ = self.modem_input.text()
@@ -264,6 +591,38 @@ class TBASMainWindow(QMainWindow, Ui_MainWindow):
                 self._future_modem_input.set_result(input_)
                 self.modem_input.setText("")
 
+    def current_operator(self):
+        if self.current_context:
+            return self.current_context.operator
+        return None
+
+    def setup_log(self):
+        if self.log_handler:
+            return
+        self.log_handler = TBASLogHandler(
+            self.log_buffer, operator=self.current_operator)
+        self.tbas.logger.addHandler(self.log_handler)
+        self.set_log_level()
+        self.log_timer = QtCore.QTimer(self)
+        self.log_timer.setInterval(100)
+        self.log_timer.timeout.connect(self.log_handler.drain)
+        self.log_timer.start()
+
+        self.log_operators = QtWidgets.QLineEdit(self.log_buttons)
+        self.log_operators.setPlaceholderText('operators')
+        self.log_operators.setToolTip(
+            'Only log while evaluating these operators (blank: all)')
+        self.log_buttons.layout().insertWidget(1, self.log_operators)
+        self.log_operators.textChanged.connect(self.set_log_operators)
+
+    def outputs_tab_changed(self, index):
+        if self.outputs_tabs.widget(index) is self.log_tab:
+            self.setup_log()
+
+    def set_log_operators(self, text):
+        operators = set(text) & set(OPERATORS)
+        self.log_handler.operators = operators or None
+
     def set_log_level(self):
         index = self.log_level.currentIndex()
         # TODO: hack!
@@ -286,37 +645,82 @@ class TBASMainWindow(QMainWindow, Ui_MainWindow):
 
 
     def run_step_button_clicked(self, index):
-        pass
+        self.tbas_resume_program('step')
 
     def run_to_breakpoint_button_clicked(self, index):
-        pass
+        self.tbas_resume_program('run_until')
 
     def run_to_end_button_clicked(self, index):
-        pass
+        self.tbas_resume_program('run')
 
 
     def reset_button_clicked(self, index):
-        pass
+        self.tbas_cancel()
+        self.tbas_load_program()
+        self.set_stack_depth()
 
     def reset_run_step_button_clicked(self, index):
-        pass
+        self.tbas_cancel()
+        self.tbas_load_program()
+        self.tbas_resume_program('step')
 
     def reset_run_to_breakpoint_button_clicked(self, index):
-        pass
+        self.tbas_cancel()
+        self.tbas_load_program()
+        self.tbas_resume_program('run_until')
 
     def reset_run_to_end_button_clicked(self, index):
         self.program_input_set_clean()
         self.tbas_evaluate_program()
 
     def remove_breakpoints_button_clicked(self, index):
-        pass
+        self.breakpoints.clear()
+        self.show_breakpoints()
 
 
     def memory_select_currentIndexChanged(self, index):
-        pass
+        self.memory_model.set_format(self.byte_formats[index])
+
+    def memory_equal_button_clicked(self, index):
+        address = self.memory_address.value()
+        value = self.memory_input.text()
+        if value.isdigit():
+            value = int(value)
+            self.tbas.watch_mcell(address, lambda v: v == value)
+            self.statusbar.showMessage(
+                'Watching mcell[{}] == {}'.format(address, value))
+        else:
+            self.tbas.watch_mcell(address)
+            self.statusbar.showMessage('Watching mcell[{}]'.format(address))
+
+    def memory_zero_button_clicked(self, index):
+        self.tbas.watchpoints.mcell.pop(self.memory_address.value(), None)
+
+    def memory_zero_all_button_clicked(self, index):
+        self.tbas.watchpoints.mcell.clear()
+
+    def buffer_equal_button_clicked(self, index):
+        length = self.buffer_address.value()
+        if length:
+            self.tbas.watch_icell(length)
+        imode = self.buffer_input.text()
+        if imode.isdigit():
+            self.tbas.watch_imode(int(imode))
+        self.statusbar.showMessage('Watching icell_len {} imode {}'.format(
+            sorted(self.tbas.watchpoints.icell),
+            sorted(self.tbas.watchpoints.imode)))
+
+    def buffer_zero_button_clicked(self, index):
+        self.tbas.watchpoints.icell.discard(self.buffer_address.value())
+        imode = self.buffer_input.text()
+        if imode.isdigit():
+            self.tbas.watchpoints.imode.discard(int(imode))
+
+    def buffer_zero_all_button_clicked(self, index):
+        self.tbas.clear_watchpoints()
 
     def buffer_select_currentIndexChanged(self, index):
-        pass
+        self.io_model.set_format(self.byte_formats[index])
 
 
     def console_enable_stateChanged(self, value):
@@ -350,9 +754,12 @@ class TBASMainWindow(QMainWindow, Ui_MainWindow):
 
 
     def log_level_currentIndexChanged(self, index):
+        self.setup_log()
         self.set_log_level()
 
     def log_reset_button_clicked(self, index):
+        if self.log_handler:
+            self.log_handler.records.clear()
         self.log_buffer.setText("")
 
 
@@ -366,12 +773,53 @@ class TBASMainWindow(QMainWindow, Ui_MainWindow):
 
     def program_input_textChanged(self):
         self.program_input_set_dirty()
+        self.analysis_timer.start()
+
+    def analyze_program(self):
+        # not through compile_program: every draft typed would evict the
+        # cached programs that are actually being run. The result is kept
+        # instead, so running this text doesn't compile it again
+        text = self.program_input.toPlainText()
+        future = self.main_loop.run_in_executor(
+            self.analysis_executor, Program, text)
+        future.add_done_callback(partial(self.analysis_complete, text))
+
+    def analysis_complete(self, text, future):
+        if text != self.program_input.toPlainText():
+            return
+        program = future.result()
+        self.analysed = (text, program)
+        unmatched = set(program.unmatched)
+        if unmatched != self.highlighter.unmatched:
+            self.highlighter.unmatched = unmatched
+            self.highlighter.rehighlight()
+        message = '{} instructions, {} folded'.format(
+            len(program), program.n_folded)
+        if unmatched:
+            message += ', {} unmatched brackets'.format(len(unmatched))
+        self.statusbar.showMessage(message)
+
+
+def report_startup(app, imported, constructed):
+    # runs once the event loop is idle, i.e. the window has been painted;
+    # every time is from before this module's imports
+    shown = time.perf_counter()
+    print('imported in {:.1f}ms, window constructed in {:.1f}ms, '
+          'shown in {:.1f}ms'.format(
+              (imported - _import_started) * 1000,
+              (constructed - _import_started) * 1000,
+              (shown - _import_started) * 1000))
+    app.quit()
 
 
 def main():
+    imported = time.perf_counter()
     app = QApplication(['TBAS'])
     tbas = TBASMainWindow(app)
     tbas.show()
+    if '--startup-time' in sys.argv[1:]:
+        QtCore.QTimer.singleShot(0, partial(
+            report_startup, app, imported, time.perf_counter()))
     sys.exit(app.exec_())
     
 
@@ -0,0 +1,121 @@
+from tbas.alu import BINARY, BYTE_MAX, UNARY
+
+# How many times a loop has to start before it is compiled
+HOT_LOOP = 8
+# Steps a compiled loop may run before handing back to the interpreter
+BUDGET = 1 << 16
+
+# '?' in these imodes only touches mcell and icell, so compiled code can
+# do it in place; any other imode deoptimizes. Each is a statement with
+# the '?' instruction's eptr as eptr.
+OPERATIONS = {
+    6: 'ctx.icell = bytearray(ctx.source.encode())',
+    8: 'ctx.icell.append(mcell[mptr])',
+    9: 'mcell[mptr] = ctx.icell.pop() if ctx.icell else 0',
+    10: 'mcell[mptr] = ctx.icell.pop(0) if ctx.icell else 0',
+    11: 'ctx.icell = bytearray()',
+    24: 'mcell[mptr] = mptr',
+    25: 'mcell[mptr] = min({eptr} + 1, %d)' % BYTE_MAX,
+    }
+for _imode in UNARY:
+    OPERATIONS[_imode] = (
+        'mcell[mptr] = _unary[%d][mcell[mptr]]' % _imode)
+for _imode in BINARY:
+    OPERATIONS[_imode] = (
+        'mcell[mptr] = _binary[%d][mcell[mptr] << 8 | '
+        '(ctx.icell.pop(0) if ctx.icell else 0)]' % _imode)
+
+
+def _deopt(ctx, mptr, steps, iptr, loops):
+    # hand back to the interpreter at iptr, inside the given open loops
+    ctx.mptr = mptr
+    ctx.iptr = iptr
+    ctx.steps += steps
+    ctx.loop_ref.extend(loops)
+    return steps
+
+
+def compile_loop(program, start):
+    """Compile the loop whose '[' is instruction start into a function
+    f(ctx, budget=BUDGET). It runs from that '[' with the same effect and
+    step count as the step engine, without frames, until the loop ends, an
+    operation it can't do in place comes up, or budget steps are spent.
+    It leaves ctx at the next instruction to run and returns the number of
+    steps taken. Returns None if the loop can't be compiled.
+    """
+    code, runs, jumps = program.code, program.runs, program.jumps
+    positions = program.positions
+    end = jumps[start]
+    if code[start] != '[' or end < 0:
+        return None
+
+    lines = [
+        'def loop(ctx, budget={}):'.format(BUDGET),
+        '    mcell = ctx.mcell',
+        '    mptr = ctx.mptr',
+        '    top = len(mcell) - 1',
+        '    steps = 0',
+        ]
+    opened = []
+    indent = '    '
+
+    def emit(line):
+        lines.append(indent + line)
+
+    def deopt(i):
+        return 'return _deopt(ctx, mptr, steps, {}, {!r})'.format(
+            i, tuple(positions[j] for j in opened))
+
+    i = start
+    while i <= end:
+        op = code[i]
+        k = 1
+        if op == '[':
+            emit('while True:')
+            indent += '    '
+            emit('if steps >= budget:')
+            emit('    ' + deopt(i))
+            emit('if not mcell[mptr]:')
+            emit('    steps += {}'.format(jumps[i] - i + 1))
+            emit('    break')
+            emit('steps += 1')
+            opened.append(i)
+        elif op == ']':
+            emit('steps += 1')
+            opened.pop()
+            indent = indent[:-4]
+        else:
+            k = runs[i]
+            if op == '+':
+                emit('mcell[mptr] = min(mcell[mptr] + {}, {})'.format(
+                    k, BYTE_MAX))
+            elif op == '-':
+                emit('mcell[mptr] = max(mcell[mptr] - {}, 0)'.format(k))
+            elif op == '>':
+                emit('mptr = min(mptr + {}, top)'.format(k))
+            elif op == '<':
+                emit('mptr = max(mptr - {}, 0)'.format(k))
+            elif op == '=':
+                emit('ctx.imode = mcell[mptr]')
+            else:
+                emit('imode = ctx.imode')
+                for n, (imode, statement) in enumerate(
+                        sorted(OPERATIONS.items())):
+                    emit('{} imode == {}:'.format('elif' if n else 'if', imode))
+                    emit('    ' + statement.format(eptr=positions[i]))
+                emit('else:')
+                emit('    ' + deopt(i))
+            emit('steps += {}'.format(k))
+        i += k
+
+    emit('ctx.mptr = mptr')
+    emit('ctx.iptr = {}'.format(end + 1))
+    emit('ctx.steps += steps')
+    emit('return steps')
+
+    namespace = {
+        '_deopt': _deopt, '_unary': UNARY, '_binary': BINARY,
+        }
+    exec(compile('\n'.join(lines), '<tbas loop {}>'.format(start), 'exec'),
+         namespace)
+    return namespace['loop']
@@ -275,7 +275,7 @@ class Ui_MainWindow(object):
         self.console_input.setFont(font)
         self.console_input.setObjectName("console_input")
         self.horizontalLayout_4.addWidget(self.console_input)
-        self.console_blocked = QtQuickWidgets.QQuickWidget(self.console_buttons)
+        self.console_blocked = QtWidgets.QWidget(self.console_buttons)
         self.console_blocked.setMinimumSize(QtCore.QSize(16, 0))
         self.console_blocked.setObjectName("console_blocked")
         self.horizontalLayout_4.addWidget(self.console_blocked)
@@ -336,7 +336,7 @@ class Ui_MainWindow(object):
         self.modem_input.setFont(font)
         self.modem_input.setObjectName("modem_input")
         self.horizontalLayout_5.addWidget(self.modem_input)
-        self.modem_blocked = QtQuickWidgets.QQuickWidget(self.modem_buttons)
+        self.modem_blocked = QtWidgets.QWidget(self.modem_buttons)
         self.modem_blocked.setMinimumSize(QtCore.QSize(16, 0))
         self.modem_blocked.setObjectName("modem_blocked")
         self.horizontalLayout_5.addWidget(self.modem_blocked)
@@ -756,4 +756,3 @@ class Ui_MainWindow(object):
         self.actionPaste.setText(_translate("MainWindow", "Paste"))
         self.actionSelect_All.setText(_translate("MainWindow", "Select All"))
 
-from PyQt5 import QtQuickWidgets
@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from tbas.tbas import Interpreter
+
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = os.environ.get('TBAS_SOCKET', 'tbas.sock')
+# steps a served program may run before it is stopped
+MAX_STEPS = 10 ** 7
+
+# Every message either way is a frame: its length, then that many bytes
+_frame = struct.Struct('<I')
+# flags, len(program), len(console input), len(modem input)
+_request = struct.Struct('<BIII')
+# ok, steps, run time in ns, len(console output), len(modem output),
+# len(error)
+_response = struct.Struct('<BQQIII')
+
+FAST = 1
+JIT = 2
+
+Result = namedtuple('Result', ['ok', 'steps', 'elapsed', 'console', 'modem',
+                               'error'])
+
+
+def encode_request(program, console=b'', modem=b'', fast=False, jit=False):
+    program = program.encode()
+    flags = (FAST if fast else 0) | (JIT if jit else 0)
+    payload = b''.join([
+        _request.pack(flags, len(program), len(console), len(modem)),
+        program, console, modem])
+    return _frame.pack(len(payload)) + payload
+
+
+def decode_request(payload):
+    """(program, console, modem, fast, jit) from a request frame's
+    payload. console and modem are memoryviews into it."""
+    view = memoryview(payload)
+    flags, n_program, n_console, n_modem = _request.unpack_from(view)
+    offset = _request.size
+    program = bytes(view[offset:offset + n_program]).decode()
+    offset += n_program
+    console = view[offset:offset + n_console]
+    offset += n_console
+    modem = view[offset:offset + n_modem]
+    return program, console, modem, bool(flags & FAST), bool(flags & JIT)
+
+
+def encode_response(result):
+    error = result.error.encode()
+    payload = b''.join([
+        _response.pack(result.ok, result.steps, result.elapsed,
+                       len(result.console), len(result.modem), len(error)),
+        result.console, result.modem, error])
+    return _frame.pack(len(payload)) + payload
+
+
+def decode_response(payload):
+    ok, steps, elapsed, n_console, n_modem, n_error = \
+        _response.unpack_from(payload)
+    offset = _response.size
+    console = bytes(payload[offset:offset + n_console])
+    offset += n_console
+    modem = bytes(payload[offset:offset + n_modem])
+    offset += n_modem
+    error = bytes(payload[offset:offset + n_error]).decode()
+    return Result(bool(ok), steps, elapsed, console, modem, error)
+
+
+class Server(object):
+    """Runs programs sent over a Unix domain socket on a pool of worker
+    threads. Each worker keeps its own Interpreter; they share the process'
+    compiled-program cache, so a program is only compiled once however
+    often it is sent.
+
+    Programs run headless with run_sync, so tasks that need the event loop
+    fail, and are stopped with an error once they run over max_steps, so
+    that one endless program can't tie up a worker. A connection may send
+    any number of requests without waiting; responses come back in the
+    same order, at most window of them in flight per connection.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, workers=4, window=64,
+                 max_steps=MAX_STEPS):
+        self.path = path
+        self.window = window
+        self.max_steps = max_steps
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='tbas-serve')
+        self.local = threading.local()
+        self.served = 0
+        self.server = None
+
+    def _interpreter(self):
+        if not hasattr(self.local, 'interpreter'):
+            self.local.interpreter = Interpreter()
+        return self.local.interpreter
+
+    def _run(self, payload):
+        start = time.perf_counter_ns()
+        try:
+            program, console, modem, fast, jit = decode_request(payload)
+            ctx = self._interpreter().run_sync(
+                program, console=console, modem=modem, fast=fast, jit=jit,
+                max_steps=self.max_steps)
+            result = Result(True, ctx.steps, 0, ctx.console.output,
+                            ctx.modem.output, '')
+        except Exception as e:
+            _log.error(e)
+            result = Result(False, 0, 0, b'', b'', str(e))
+        return encode_response(
+            result._replace(elapsed=time.perf_counter_ns() - start))
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_event_loop()
+        pending = asyncio.Queue(self.window)
+
+        async def respond():
+            while True:
+                future = await pending.get()
+                if future is None:
+                    break
+                response = await future
+                self.served += 1
+                writer.write(response)
+                await writer.drain()
+
+        responder = asyncio.ensure_future(respond())
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(_frame.size)
+                except asyncio.IncompleteReadError:
+                    break
+                payload = await reader.readexactly(_frame.unpack(header)[0])
+                await pending.put(
+                    loop.run_in_executor(self.executor, self._run, payload))
+            await pending.put(None)
+            await responder
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            _log.info('Connection lost: {}'.format(e))
+            responder.cancel()
+        finally:
+            writer.close()
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(
+            self._handle, path=self.path)
+        _log.info('Serving on {}'.format(self.path))
+        return self.server
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        self.executor.shutdown(wait=False)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class Client(object):
+    """Blocking client for a Server."""
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile('rwb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _receive(self):
+        header = self.file.read(_frame.size)
+        if len(header) < _frame.size:
+            raise ConnectionError('Server closed the connection')
+        return decode_response(self.file.read(_frame.unpack(header)[0]))
+
+    def run(self, program, console=b'', modem=b'', fast=False, jit=False):
+        self.file.write(encode_request(program, console, modem, fast, jit))
+        self.file.flush()
+        return self._receive()
+
+    def run_many(self, requests, window=64):
+        """Send (program, console, modem) requests without waiting for each
+        answer, keeping up to window in flight, and yield their Results in
+        order.
+
+        Requests are sent from a thread while answers are read here: a
+        server stops reading while it waits to write answers, so sending
+        a whole window first can leave both sides blocked on full socket
+        buffers."""
+        slots = threading.Semaphore(window)
+        sent = queue.Queue()
+        stop = threading.Event()
+
+        def send():
+            try:
+                for request in requests:
+                    slots.acquire()
+                    if stop.is_set():
+                        break
+                    self.socket.sendall(encode_request(*request))
+                    sent.put(True)
+            except Exception as e:
+                sent.put(e)
+            else:
+                sent.put(None)
+
+        self.file.flush()
+        threading.Thread(target=send, daemon=True).start()
+        try:
+            while True:
+                item = sent.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield self._receive()
+                slots.release()
+        finally:
+            # let the sender see stop if it is waiting for a slot
+            stop.set()
+            slots.release()
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
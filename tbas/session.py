@@ -0,0 +1,73 @@
+import struct
+
+
+SESSION_MAGIC = b'TBio'
+SESSION_VERSION = 1
+
+KINDS = ['console_read', 'console_write', 'modem_read', 'modem_write']
+
+# magic, version, len(source), records
+_file_header = struct.Struct('<4sBII')
+# kind, steps, len(value)
+_record = struct.Struct('<BQH')
+
+
+class Session(object):
+    """Every console and modem read and write of a run, in order, with the
+    step it happened on. Written by Interpreter.run(record=path) and
+    played back by Interpreter.replay(path).
+
+    records are (kind, steps, value) with kind one of KINDS.
+    """
+
+    def __init__(self, source, records=()):
+        self.source = source
+        self.records = list(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def from_events(cls, source, events):
+        return cls(source, ((e.kind, e.steps, e.value) for e in events
+                            if e.kind in KINDS))
+
+    def reads(self, channel):
+        """Everything read from channel, as bytes."""
+        kind = channel + '_read'
+        return ''.join(value for k, _, value in self.records
+                       if k == kind).encode('latin-1')
+
+    def writes(self):
+        return [r for r in self.records if r[0].endswith('_write')]
+
+    def save(self, path):
+        source = self.source.encode()
+        parts = [_file_header.pack(SESSION_MAGIC, SESSION_VERSION,
+                                   len(source), len(self.records)), source]
+        for kind, steps, value in self.records:
+            value = value.encode('latin-1')
+            parts.append(_record.pack(KINDS.index(kind), steps, len(value)))
+            parts.append(value)
+        with open(path, 'wb') as f:
+            f.write(b''.join(parts))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            view = memoryview(f.read())
+        magic, version, n_source, n_records = _file_header.unpack_from(view)
+        if magic != SESSION_MAGIC or version != SESSION_VERSION:
+            raise ValueError('Not a version {} session file'.format(
+                SESSION_VERSION))
+        offset = _file_header.size
+        source = bytes(view[offset:offset + n_source]).decode()
+        offset += n_source
+        records = []
+        for _ in range(n_records):
+            kind, steps, n = _record.unpack_from(view, offset)
+            offset += _record.size
+            value = bytes(view[offset:offset + n]).decode('latin-1')
+            offset += n
+            records.append((KINDS[kind], steps, value))
+        return cls(source, records)
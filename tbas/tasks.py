@@ -0,0 +1,209 @@
+import asyncio
+import logging
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
+
+_log = logging.getLogger(__name__)
+
+# A backend for task number n, run by imode 7 with mcell[mptr] == n. The
+# handler gets the contents of icell as bytes. Blocking handlers are
+# coroutine functions called as handler(context, data) on the interpreter's
+# loop, and the program waits for them; the rest are plain functions run on
+# the task executor while the program carries on.
+Task = namedtuple('Task', ['name', 'handler', 'blocking'])
+
+TASKS = {}
+
+
+def register_task(number, name, handler, blocking=False):
+    TASKS[number] = Task(name, handler, blocking)
+
+
+def task(number, name, blocking=False):
+    """Decorator form of register_task."""
+    def register(handler):
+        register_task(number, name, handler, blocking)
+        return handler
+    return register
+
+
+class SinkHandler(object):
+    """A task handler that renders to sink. A sink with a slot() method,
+    such as tbas.audio.StreamSink, gets a slot per task, taken when the
+    task is submitted, so that its output keeps the order the program ran
+    the tasks in however the executor finishes them."""
+
+    def __init__(self, handler, sink):
+        self.handler = handler
+        self.sink = sink
+
+    def bind(self):
+        if not hasattr(self.sink, 'slot'):
+            return partial(self.handler, sink=self.sink)
+        return partial(_run_in_slot, self.handler, self.sink.slot())
+
+    def __call__(self, data):
+        return self.bind()(data)
+
+
+def _run_in_slot(handler, slot, data):
+    try:
+        return handler(data, sink=slot)
+    finally:
+        # release the slot even if nothing was written to it
+        slot.close()
+
+
+class TaskRunner(object):
+    """Hands non-blocking tasks to an executor. At most maxsize tasks are
+    outstanding; submitting another waits for the oldest to finish.
+
+    Handlers must be picklable, i.e. module level functions, to use a
+    ProcessPoolExecutor.
+    """
+
+    def __init__(self, executor=None, maxsize=16):
+        self._executor = executor
+        self.maxsize = maxsize
+        self.pending = []
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix='tbas-task')
+        return self._executor
+
+    def _prune(self):
+        self.pending = [f for f in self.pending if not f.done()]
+
+    @staticmethod
+    def _report(future):
+        if not future.cancelled() and future.exception():
+            _log.error('Task failed: {}'.format(future.exception()))
+
+    async def submit(self, context, task, data):
+        if task.blocking:
+            return await task.handler(context, data)
+        self._prune()
+        while len(self.pending) >= self.maxsize:
+            await asyncio.wrap_future(self.pending[0])
+            self._prune()
+        handler = task.handler
+        if isinstance(handler, SinkHandler):
+            handler = handler.bind()
+        future = self.executor.submit(handler, data)
+        future.add_done_callback(self._report)
+        self.pending.append(future)
+        return None
+
+    async def join(self):
+        """Wait for every outstanding task."""
+        while self.pending:
+            await asyncio.wait([asyncio.wrap_future(f) for f in self.pending])
+            self._prune()
+
+    def wait(self):
+        """Block until every outstanding task is done, without an event
+        loop."""
+        wait(self.pending)
+        self._prune()
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        self.pending = []
+
+
+def _ascii(data):
+    return data.decode('ascii', errors='replace')
+
+
+@task(0, 'tbas', blocking=True)
+async def tbas(context, data):
+    _log.info('tbas {}'.format(_ascii(data)))
+    await context.run_child(_ascii(data))
+
+
+@task(1, 'config', blocking=True)
+async def config(context, data):
+    _log.info('config {}'.format(_ascii(data)))
+
+
+@task(2, 'tonegn')
+def tonegn(data, sink=None):
+    _log.info('tonegn {}'.format(_ascii(data)))
+    if sink is not None:
+        from tbas.audio import render_tones
+        return sink.write('tonegn', render_tones(data, sink.rate))
+
+
+@task(3, 'blinken')
+def blinken(data, sink=None):
+    params = data[:7].ljust(7, b'\0')
+    _log.info('blinken {} {} {} {} {} {} {}'.format(*params))
+    if sink is not None:
+        from tbas.display import blinken_frames
+        return sink.write('blinken', blinken_frames(*params))
+
+
+@task(4, 'scroller')
+def scroller(data, sink=None):
+    ppong, steps, blanks = data[:3].ljust(3, b'\0')
+    text = _ascii(data[3:])
+    _log.info('scroller {} {} {} {}'.format(ppong, steps, blanks, text))
+    if sink is not None:
+        from tbas.display import scroll_frames
+        return sink.write('scroller', scroll_frames(
+            text, ppong, steps, blanks))
+
+
+@task(5, 'tbased')
+def tbased(data):
+    _log.info('tbased {}'.format(_ascii(data)))
+
+
+@task(6, 'tbasctl')
+def tbasctl(data):
+    _log.info('tbasctl {}'.format(_ascii(data)))
+
+
+@task(8, 'autodt')
+def autodt(data, sink=None):
+    num = data[:1]
+    tts = _ascii(data[1:])
+    _log.info('autodt {} {}'.format(num[0] if num else None, tts))
+    if sink is not None:
+        from tbas.audio import render_dial
+        # dial tts num times, a pause apart
+        return sink.write('autodt', render_dial(
+            ','.join([tts] * (num[0] if num else 1)), sink.rate))
+
+
+@task(9, 'dialer')
+def dialer(data, sink=None):
+    _log.info('dialer {}'.format(_ascii(data)))
+    if sink is not None:
+        from tbas.audio import render_dial
+        return sink.write('dialer', render_dial(_ascii(data), sink.rate))
+
+
+def audio_tasks(sink):
+    """The tonegn, autodt and dialer tasks, rendering PCM to sink (see
+    tbas.audio) instead of only logging, e.g. for
+    interpreter.tasks.update(audio_tasks(WavSink('out')))."""
+    return dict(
+        (n, Task(TASKS[n].name, SinkHandler(TASKS[n].handler, sink), False))
+        for n in (2, 8, 9))
+
+
+def display_tasks(sink):
+    """The blinken and scroller tasks, rendering frames to sink (see
+    tbas.display) instead of only logging."""
+    return dict(
+        (n, Task(TASKS[n].name, SinkHandler(TASKS[n].handler, sink), False))
+        for n in (3, 4))
@@ -1,15 +1,38 @@
 import asyncio
 import io
 import logging
+import struct
+import zlib
 
+from array import array
+from bisect import bisect_right
+from collections import deque, namedtuple
 from copy import copy
+from functools import lru_cache
 from itertools import zip_longest
 
+from tbas.alu import BINARY, BYTE_MAX, UNARY
+from tbas.compiler import Program, compile_program
+from tbas.jit import BUDGET, HOT_LOOP, compile_loop
+from tbas.tasks import TASKS, Task, TaskRunner
+
 
 _log = logging.getLogger(__name__)
 
-BYTE_MAX = 255
 WORKING_MEMORY_BYTES = 256
+# Handlers are awaited directly, so a long run only gives the event loop a
+# turn (and a chance to cancel it) about every this many steps
+YIELD_EVERY = 1024
+
+SNAPSHOT_MAGIC = b'TBsn'
+SNAPSHOT_VERSION = 1
+# magic, version, source crc32, mptr, imode, in_dead_loop, iptr, goto
+# (-1 for none), steps, len(mcell), len(icell), len(loop_ref)
+_snapshot_header = struct.Struct('<4sBIHBIIiQHII')
+
+# kind is 'step' (value is the frame), 'task', 'error', or a channel and
+# direction such as 'console_write'
+Event = namedtuple('Event', ['kind', 'steps', 'eptr', 'value'])
 
 
 class Context(object):
@@ -27,18 +50,18 @@ class Context(object):
         9: '_buffer_dequeue_filo',
         10: '_buffer_dequeue_fifo',
         11: '_buffer_clear',
-        12: '_convert_lower_case',
-        13: '_convert_upper_case',
-        14: '_convert_decimal',
-        15: '_convert_tbas',
-        16: '_alu_add',
-        17: '_alu_sub',
-        18: '_alu_mul',
-        19: '_alu_div',
-        20: '_alu_and',
-        21: '_alu_or',
-        22: '_alu_not',
-        23: '_alu_xor',
+        12: '_convert',
+        13: '_convert',
+        14: '_convert',
+        15: '_convert',
+        16: '_alu',
+        17: '_alu',
+        18: '_alu',
+        19: '_alu',
+        20: '_alu',
+        21: '_alu',
+        22: '_convert',
+        23: '_alu',
         24: '_get_mptr',
         25: '_get_eptr',
         26: '_jump_left',
@@ -56,44 +79,55 @@ class Context(object):
         '?': '_run_operation'
         }
 
-    tasks = {
-        0: '_exec_tbas',
-        1: '_exec_config',
-        2: '_exec_tonegn',
-        3: '_exec_blinken',
-        4: '_exec_scroller',
-        5: '_exec_tbased',
-        6: '_exec_tbascl',
-        8: '_exec_autodt',
-        9: '_exec_dialer',
-        }
+    @property
+    def n_instructions(self):
+        return len(self.program)
 
+    @property
+    def eptr(self):
+        return self.program.eptr(self.iptr)
 
     @property
-    def n_instructions(self):
-        return len(self.source)
+    def finished(self):
+        return self.iptr >= self.n_instructions
 
-    def __init__(self, program, interpreter):
+    def __init__(self, program, interpreter, parent=None):
         self.interpreter = interpreter
-        self.source = program
-        _log.debug('Context.source="{}"'.format(program))
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent else 0
+        # source text or a Program, never a path: programs come from
+        # sockets, batch records and other programs too. Files are loaded
+        # by the caller, see tbas.cli.load
+        if not isinstance(program, Program):
+            program = compile_program(program)
+        self.program = program
+        self.source = program.source
+        self.breakpoints = set()
+        self.events = None
+        self.watch_hit = None
+        # pre-fed Channels, shared with nested programs
+        self.console = parent.console if parent else None
+        self.modem = parent.modem if parent else None
+        _log.debug('Context.source="{}"'.format(self.source))
         self.reset()
 
     def __iter__(self):
         return self
 
     async def __next__(self):
-        if self.eptr == self.n_instructions:
+        if self.iptr >= self.n_instructions:
             raise StopIteration
 
-        self.operator = self.source[self.eptr]
+        self.operator = self.program.code[self.iptr]
         _log.debug('EVAL: {}'.format(self.operator))
-        await self._eval_op(self.operator)
-        if self.goto:
-            self.eptr = self.goto
+        self.steps += 1
+        frame = await self._eval_op(self.operator)
+        if self.goto is not None:
+            self.iptr = self.program.index(self.goto)
             self.goto = None
         else:
-            self.eptr += 1
+            self.iptr += 1
+        return frame
 
     def reset(self):
         self.stack = Stack()
@@ -107,13 +141,301 @@ class Context(object):
         self.in_dead_loop = 0
         self.loop_ref = []
 
-        self.eptr = 0
+        self.iptr = 0
         self.operator = None
         self.goto = None
+        self.steps = 0
+        self.nested_steps = 0
+        self.loop_counts = {}
 
-    async def run(self):
-        while self.eptr < self.n_instructions:
+    @property
+    def root(self):
+        context = self
+        while context.parent:
+            context = context.parent
+        return context
+
+    def fork(self):
+        """Clone this context so it can be run on independently. Machine
+        state is copied outright, it is only a few hundred bytes. The fork
+        starts with an empty stack, bounded like the parent's if that is a
+        FrameRing; a parent's frames stay with the parent.
+        """
+        child = copy(self)
+        child.mcell = list(self.mcell)
+        child.icell = bytearray(self.icell)
+        child.loop_ref = list(self.loop_ref)
+        child.loop_counts = dict(self.loop_counts)
+        if isinstance(self.stack, FrameRing):
+            child.stack = FrameRing(maxlen=self.stack.maxlen)
+        else:
+            child.stack = Stack()
+        child.breakpoints = set(self.breakpoints)
+        child.events = None
+        # pre-fed input is read from the same point on, independently
+        if self.console is not None:
+            child.console = self.console.copy()
+        if self.modem is not None:
+            child.modem = self.modem.copy()
+        return child
+
+    def snapshot(self):
+        """Serialize the machine state (not the stack) to bytes."""
+        goto = -1 if self.goto is None else self.goto
+        header = _snapshot_header.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+            zlib.crc32(self.source.encode()), self.mptr, self.imode,
+            self.in_dead_loop, self.iptr, goto, self.steps,
+            len(self.mcell), len(self.icell), len(self.loop_ref))
+        return b''.join([header, bytes(self.mcell), bytes(self.icell),
+                         array('I', self.loop_ref).tobytes()])
+
+    def restore(self, snapshot):
+        """Load machine state written by snapshot() for the same program.
+        The stack is cleared."""
+        view = memoryview(snapshot)
+        (magic, version, crc, mptr, imode, in_dead_loop, iptr, goto, steps,
+         n_mcell, n_icell, n_loop) = _snapshot_header.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('Not a version {} snapshot'.format(
+                SNAPSHOT_VERSION))
+        if crc != zlib.crc32(self.source.encode()):
+            raise ValueError('Snapshot is of a different program')
+        offset = _snapshot_header.size
+        self.mcell = list(view[offset:offset + n_mcell])
+        offset += n_mcell
+        self.icell = bytearray(view[offset:offset + n_icell])
+        offset += n_icell
+        loop_ref = array('I')
+        loop_ref.frombytes(view[offset:offset + 4 * n_loop])
+        self.loop_ref = loop_ref.tolist()
+
+        self.mptr = mptr
+        self.imode = imode
+        self.in_dead_loop = in_dead_loop
+        self.iptr = iptr
+        self.goto = None if goto < 0 else goto
+        self.steps = steps
+        self.operator = None
+        self.stack = Stack()
+
+    async def run(self, fast=False, jit=False, max_steps=None):
+        """Run to the end of the program. With max_steps, raise
+        LimitExceeded once more than that many steps have run; the fast
+        and jit engines may overshoot it."""
+        next_yield = self.steps + YIELD_EVERY
+        while self.iptr < self.n_instructions:
+            if self.steps >= next_yield:
+                await asyncio.sleep(0)
+                next_yield = self.steps + YIELD_EVERY
+            if max_steps is not None and self.steps > max_steps:
+                msg = 'Program ran over {} steps @{}'.format(
+                    max_steps, self.eptr)
+                _log.warn(msg)
+                raise LimitExceeded('steps', msg)
+            if fast and self._fast_forward():
+                continue
+            if jit and self._run_compiled():
+                continue
+            await next(self)
+
+    async def step(self, n=1):
+        """Evaluate up to n instructions, returning how many were run."""
+        start = self.steps
+        while n > self.steps - start and not self.finished:
             await next(self)
+        return self.steps - start
+
+    async def run_until(self, predicate=None):
+        """Run until the next breakpoint, until a watchpoint fires, until
+        predicate(context) is true or to the end of the program. Returns
+        True if execution stopped early. Without a predicate, the fast
+        engine is used up to the breakpoint. Breakpoints are source eptrs
+        and only stop live instructions, not ones skipped over in a dead
+        loop.
+        """
+        breaks = sorted(set(self.program.index(b) for b in self.breakpoints))
+        stops = set(breaks)
+        watchpoints = self.interpreter.watchpoints
+        start = self.steps
+        self.watch_hit = None
+        next_yield = self.steps + YIELD_EVERY
+        while not self.finished:
+            # the fast engine runs at most a budget of steps at a time, so
+            # this gets to stop at a watchpoint and to be cancelled
+            if self.steps >= next_yield:
+                await asyncio.sleep(0)
+                next_yield = self.steps + YIELD_EVERY
+            if self.watch_hit:
+                _log.info('Watchpoint {} @{}'.format(self.watch_hit, self.eptr))
+                return True
+            if self.steps > start and not self.in_dead_loop:
+                if self.iptr in stops:
+                    return True
+                if predicate and predicate(self):
+                    return True
+            if predicate is None and self._fast_forward(breaks):
+                continue
+            op = self.program.code[self.iptr]
+            before = (self.mptr, self.mcell[self.mptr], len(self.icell))
+            frame = await next(self)
+            if watchpoints and not frame.noop:
+                self.watch_hit = watchpoints.check(self, op, *before)
+        return bool(self.watch_hit)
+
+    def _fast_forward(self, breaks=(), budget=BUDGET):
+        # Run folded instructions in place, without building frames, until
+        # the next '?', a breakpoint index in breaks, anything the compiled
+        # form can't vouch for (dead loops, loop_ref disturbed by a jump,
+        # unmatched brackets) or about budget steps, so that the caller gets
+        # to check limits and cancellation. Returns the number of steps the
+        # step engine would have taken.
+        if self.in_dead_loop:
+            return 0
+        stops = set(breaks)
+        watchpoints = self.interpreter.watchpoints
+        watched = watchpoints.mcell
+        hit = None
+        program = self.program
+        code, runs, jumps = program.code, program.runs, program.jumps
+        positions = program.positions
+        n = len(code)
+        mcell = self.mcell
+        mptr = self.mptr
+        loop_ref = self.loop_ref
+        mptr_max = len(mcell) - 1
+        i = self.iptr
+        steps = 0
+
+        while i < n and steps < budget:
+            if steps and i in stops:
+                break
+            op = code[i]
+            if op in '+-><':
+                k = runs[i]
+                if stops:
+                    b = bisect_right(breaks, i)
+                    if b < len(breaks) and breaks[b] < i + k:
+                        k = breaks[b] - i
+                if op == '+':
+                    if mptr in watched:
+                        k, mvalue = 1, mcell[mptr]
+                    mcell[mptr] = min(mcell[mptr] + k, BYTE_MAX)
+                    if mptr in watched:
+                        hit = watchpoints.check(self, op, mptr, mvalue)
+                elif op == '-':
+                    if mptr in watched:
+                        k, mvalue = 1, mcell[mptr]
+                    mcell[mptr] = max(mcell[mptr] - k, 0)
+                    if mptr in watched:
+                        hit = watchpoints.check(self, op, mptr, mvalue)
+                elif op == '>':
+                    mptr = min(mptr + k, mptr_max)
+                else:
+                    mptr = max(mptr - k, 0)
+            elif op == '[':
+                if mcell[mptr]:
+                    loop_ref.append(positions[i])
+                    k = 1
+                elif jumps[i] < 0:
+                    break
+                else:
+                    k = jumps[i] - i + 1
+            elif op == ']':
+                j = jumps[i]
+                if j < 0 or not loop_ref or loop_ref[-1] != positions[j]:
+                    break
+                loop_ref.pop()
+                steps += 1
+                i = j
+                continue
+            elif op == '=':
+                self.imode = mcell[mptr]
+                k = 1
+                if watchpoints.imode:
+                    hit = watchpoints.check(self, op, mptr)
+            else:
+                break
+            steps += k
+            i += k
+            if hit:
+                self.watch_hit = hit
+                break
+
+        self.mptr = mptr
+        self.iptr = i
+        self.steps += steps
+        if steps:
+            self.operator = code[i - 1] if i else None
+            self.stack.append(Frame(self, msg='fast forward {}'.format(steps)))
+        return steps
+
+    async def run_child(self, source, chunk=1024):
+        """Run source as a nested program on the same interpreter, so with
+        the same IO. interpreter.limits apply to all nested programs
+        together: their depth, their total steps and the memory held by
+        the whole chain of contexts. Children always use the step engine,
+        a chunk of steps at a time, so that a runaway loop still hits the
+        step limit. Their frames aren't kept.
+        """
+        limits = self.interpreter.limits
+        if self.depth >= limits.depth:
+            msg = 'Nesting deeper than {} @{}'.format(limits.depth, self.eptr)
+            _log.warn(msg)
+            raise LimitExceeded('depth', msg)
+        child = Context(source, self.interpreter, parent=self)
+        child.events = self.events
+        root = self.root
+        while not child.finished:
+            budget = limits.steps - root.nested_steps
+            if budget <= 0:
+                msg = 'Nested programs ran over {} steps @{}'.format(
+                    limits.steps, self.eptr)
+                _log.warn(msg)
+                raise LimitExceeded('steps', msg)
+            root.nested_steps += await child.step(min(budget, chunk))
+            child.stack.clear()
+            memory = 0
+            context = child
+            while context:
+                memory += (len(context.mcell) + len(context.icell) +
+                           len(context.source))
+                context = context.parent
+            if memory > limits.memory:
+                msg = 'Nested programs used over {} bytes @{}'.format(
+                    limits.memory, self.eptr)
+                _log.warn(msg)
+                raise LimitExceeded('memory', msg)
+        return child
+
+    def _run_compiled(self):
+        # Count how often each loop starts; once one is hot, run it through
+        # its compiled form until it ends or deoptimizes. Returns the number
+        # of steps taken.
+        i = self.iptr
+        code = self.program.code
+        if (code[i] != '[' or self.in_dead_loop or
+                self.interpreter.watchpoints):
+            return 0
+        count = self.loop_counts.get(i, 0) + 1
+        self.loop_counts[i] = count
+        if count < HOT_LOOP:
+            return 0
+        loops = self.program.loops
+        if i not in loops:
+            loops[i] = compile_loop(self.program, i)
+            _log.debug('Compiled loop @{}'.format(self.eptr))
+        if loops[i] is None:
+            return 0
+        steps = loops[i](self)
+        if steps:
+            self.operator = code[self.iptr - 1]
+            self.stack.append(Frame(self, msg='compiled loop {}'.format(steps)))
+        return steps
+
+    def _emit(self, kind, value=None):
+        if self.events is not None:
+            self.events.append(Event(kind, self.steps, self.eptr, value))
 
     async def _eval_op(self, operator):
         assert operator in self.operators.keys()
@@ -122,8 +444,7 @@ class Context(object):
         _log.debug('Context.eval "{}" mcell={} l_iob={} @{} -> {}'.format(
             operator, mvalue, len(self.icell),
             self.eptr, command))
-        future = asyncio.ensure_future(getattr(self, command)())
-        frame = await future
+        frame = await getattr(self, command)()
         _log.debug('Created {}'.format(frame))
         if not isinstance(frame, Frame):
             frame = Frame(self)
@@ -133,7 +454,7 @@ class Context(object):
     async def _advance_mptr(self):
         if self.in_dead_loop:
             return Frame(self, noop=True, msg="in dead loop")
-        if self.mptr == len(self.mcell):
+        if self.mptr == len(self.mcell) - 1:
             return Frame(self, noop=True, msg="mptr at extent")
         self.mptr += 1
         return Frame(self)
@@ -199,57 +520,59 @@ class Context(object):
             raise UserWarning(msg)
         command = self.imodes[self.imode]
         _log.debug('Context._run_operation "{}"'.format(command))
-        future = asyncio.ensure_future(getattr(self, command)())
-        await future
-        return future.result()
+        return await getattr(self, command)()
+
+    async def _read(self, channel):
+        # One character from the pre-fed channel if there is one, else from
+        # the interpreter's read callback. None if there's neither.
+        fed = getattr(self, channel)
+        if fed is not None:
+            ivalue = fed.read()
+        elif getattr(self.interpreter, channel + '_read'):
+            reader = getattr(self.interpreter, '_{}_read'.format(channel))
+            ivalue = (await reader(1)).result()
+        else:
+            return None
+        _log.debug('READ "{}"'.format(ivalue))
+        self._emit(channel + '_read', ivalue)
+        return ivalue
+
+    async def _write(self, channel, value):
+        fed = getattr(self, channel)
+        writer = getattr(self.interpreter, channel + '_write')
+        if fed is None and not writer:
+            return
+        _log.debug('WRITE "{}"'.format(value))
+        self._emit(channel + '_write', value)
+        if fed is not None:
+            fed.write(value)
+        else:
+            await writer(value)
 
     async def _console_decimal_write(self):
-        mvalue = self.mcell[self.mptr]
-        if self.interpreter.console_write:
-            _log.debug('WRITE "{}"'.format(str(mvalue)))
-            await asyncio.ensure_future(
-                self.interpreter.console_write(str(mvalue)))
+        await self._write('console', str(self.mcell[self.mptr]))
 
     async def _console_decimal_read(self):
-        if self.interpreter.console_read:
-            future = asyncio.ensure_future(self.interpreter._console_read(1))
-            task = await future
-            ivalue = task.result()
-            _log.debug('READ "{}"'.format(ivalue))
+        ivalue = await self._read('console')
+        if ivalue is not None:
             if not ivalue.isdigit():
                 ivalue = ord(ivalue)
             self.mcell[self.mptr] = int(ivalue) % (BYTE_MAX + 1)
 
     async def _console_ascii_write(self):
-        mvalue = self.mcell[self.mptr]
-        if self.interpreter.console_write:
-            _log.debug('WRITE "{}"'.format(chr(mvalue)))
-            await asyncio.ensure_future(
-                self.interpreter.console_write(chr(mvalue)))
+        await self._write('console', chr(self.mcell[self.mptr]))
 
     async def _console_ascii_read(self):
-        if self.interpreter.console_read:
-            future = asyncio.ensure_future(self.interpreter._console_read(1))
-            task = await future
-            ivalue = task.result()
-            _log.debug('READ "{}"'.format(ivalue))
+        ivalue = await self._read('console')
+        if ivalue is not None:
             self.mcell[self.mptr] = ord(ivalue) % (BYTE_MAX + 1)
 
     async def _modem_ascii_write(self):
-        mvalue = self.mcell[self.mptr]
-        if self.interpreter.modem_write:
-            _log.debug('WRITE "{}"'.format(chr(mvalue)))
-            await asyncio.ensure_future(
-                self.interpreter.modem_write(chr(mvalue)))
+        await self._write('modem', chr(self.mcell[self.mptr]))
 
     async def _modem_ascii_read(self):
-        if self.interpreter.modem_read:
-            future = asyncio.ensure_future(self.interpreter._modem_read(1))
-            task = await future
-            ivalue = task.result()
-            _log.debug('READ "{}"'.format(ivalue))
-            if not ivalue.isdigit():
-                ivalue = ord(ivalue)
+        ivalue = await self._read('modem')
+        if ivalue is not None:
             self.mcell[self.mptr] = ord(ivalue) % (BYTE_MAX + 1)
 
     async def _buffer_program(self):
@@ -258,13 +581,16 @@ class Context(object):
 
     async def _execute_task(self):
         mvalue = self.mcell[self.mptr]
-        if mvalue not in self.tasks:
+        if mvalue not in self.interpreter.tasks:
             msg = 'Unknown task {} @{}'.format(mvalue, self.eptr)
             _log.warn(msg)
             raise UserWarning(msg)
-        command = self.tasks[mvalue]
-        _log.debug('Context._execute_task "{}"'.format(command))
-        getattr(self, command)()
+        task = self.interpreter.tasks[mvalue]
+        _log.debug('Context._execute_task "{}"'.format(task.name))
+        self._emit('task', task.name)
+        data = bytes(self.icell)
+        self.icell = bytearray()
+        await self.interpreter.task_runner.submit(self, task, data)
         return Frame(self)
 
     async def _buffer_enqueue(self):
@@ -295,142 +621,48 @@ class Context(object):
     async def _buffer_clear(self):
         self.icell = bytearray()
 
-    async def _convert_lower_case(self):
-        mvalue = self.mcell[self.mptr]
-        if mvalue < 26:
-            self.mcell[self.mptr] = mvalue + 97
-
-    async def _convert_upper_case(self):
-        mvalue = self.mcell[self.mptr]
-        if mvalue < 26:
-            self.mcell[self.mptr] = mvalue + 65
-
-    async def _convert_decimal(self):
-        mvalue = self.mcell[self.mptr]
-        if mvalue < 10:
-            self.mcell[self.mptr] = mvalue + 48
+    async def _convert(self):
+        self.mcell[self.mptr] = UNARY[self.imode][self.mcell[self.mptr]]
 
-    async def _convert_tbas(self):
+    async def _alu(self):
         mvalue = self.mcell[self.mptr]
-        mapping = [43, 45, 60, 62, 91, 93, 61, 63]
-        if mvalue < 8:
-            self.mcell[self.mptr] = mapping[mvalue]
-
-    async def _alu_add(self):
-        r = self.mcell[self.mptr] + self._deque_fifo()
-        self.mcell[self.mptr] = max(r, BYTE_MAX)
-
-    async def _alu_sub(self):
-        r = self.mcell[self.mptr] + self._deque_fifo()
-        self.mcell[self.mptr] = min(r, 0)
-
-    async def _alu_mul(self):
-        r = self.mcell[self.mptr] * self._deque_fifo()
-        self.mcell[self.mptr] = min(r, BYTE_MAX)
-
-    async def _alu_div(self):
         q = self._deque_fifo()
-        if q:
-            r = int(self.mcell[self.mptr] / q)
-            self.mcell[self.mptr] = min(r, 1)
-
-    async def _alu_and(self):
-        mvalue = self.mcell[self.mptr]
-        q = int(self._deque_fifo())
-        self.mcell[self.mptr] = bytes(mvalue & q)
-
-    async def _alu_or(self):
-        mvalue = self.mcell[self.mptr]
-        q = int(self._deque_fifo())
-        self.mcell[self.mptr] = bytes(mvalue | q)
-
-    async def _alu_not(self):
-        mvalue = self.mcell[self.mptr]
-        self.mcell[self.mptr] = 0 if mvalue else 1
-
-    async def _alu_xor(self):
-        mvalue = self.mcell[self.mptr]
-        q = int(self._deque_fifo())
-        self.mcell[self.mptr] = bytes(mvalue ^ q)
+        self.mcell[self.mptr] = BINARY[self.imode][mvalue << 8 | q]
 
     async def _get_mptr(self):
         self.mcell[self.mptr] = self.mptr
 
     async def _get_eptr(self):
-        self.mcell[self.mptr] = self.eptr + 1
+        # eptr counts comments too, so it can be past what a cell holds
+        self.mcell[self.mptr] = min(self.eptr + 1, BYTE_MAX)
 
     async def _jump_left(self):
         mvalue = self.mcell[self.mptr]
-        jump = max(self.n_instructions, mvalue)
-        self.goto = self.eptr - jump
+        jump = min(len(self.source), mvalue)
+        self.goto = max(self.eptr - jump, 0)
 
     async def _jump_right(self):
         mvalue = self.mcell[self.mptr]
-        jump = max(self.n_instructions, mvalue)
+        jump = min(len(self.source), mvalue)
         self.goto = self.eptr + jump
 
-    def _exec_tbas(self):
-        buf = self.icell.decode('ascii')
-        self.icell = bytearray()
-        _log.info('tbas {}'.format(buf))
-
-    def _exec_dialer(self):
-        buf = self.icell.decode('ascii')
-        self.icell = bytearray()
-        _log.info('dialer {}'.format(buf))
-
-    def _exec_blinken(self):
-        buf = self.icell.decode('ascii')
-        self.icell = bytearray()
-        part = buf.pop(0)
-        pos = buf.pop(0)
-        mask = buf.pop(0)
-        vel = buf.pop(0)
-        vel_delay = buf.pop(0)
-        lfo = buf.pop(0)
-        lfo_delay = buf.pop(0)
-        _log.info('blinken {} {} {} {} {} {} {}'.format(
-            part, pos, mask, vel, vel_delay, lfo, lfo_delay
-            ))
-
-    def _exec_scroller(self):
-        ppong = self.icell.pop(0)
-        steps = self.icell.pop(0)
-        blanks = self.icell.pop(0)
-        _log.info('scroller {} {} {} {}'.format(
-            ppong, steps, blanks, self.icell.decode('ascii')
-            ))
-        self.icell = bytearray()
-
-    def _exec_autodt(self):
-        buf = self.icell.decode('ascii')
-        self.icell = bytearray()
-        num = buf[0]
-        tts = buf[1:]
-        _log.info('autodt {} {}'.format(num, buf))
-
-    def _exec_tonegn(self):
-        buf = self.icell.decode('ascii')
-        self.icell = bytearray()
-        _log.info('tonegn {}'.format(buf))
-
-    def _exec_tbascl(self):
-        buf = self.icell.decode('ascii')
-        self.icell = bytearray()
-        _log.info('tbasctl {}'.format(buf))
-
-    def _exec_tbased(self):
-        buf = self.icell.decode('ascii')
-        self.icell = bytearray()
-        _log.info('tbased {}'.format(buf))
-
-
 
 def chunk(n, i, v=None):
     a = [iter(i)] * n
     return zip_longest(*[iter(i)]*n, fillvalue=v)
 
 
+@lru_cache(maxsize=None)
+def byte_strings(format):
+    """Every byte value rendered with format, to look up rather than
+    format each time. 'c' renders printable ascii, '.' otherwise."""
+    if format == 'c':
+        return tuple(chr(b) if 32 <= b < 127 else '.'
+                     for b in range(BYTE_MAX + 1))
+    format_string = "{:" + format + "}"
+    return tuple(format_string.format(b) for b in range(BYTE_MAX + 1))
+
+
 class Frame(object):
     _context_keys = ['mcell', 'mptr', 'icell', 'imode', 'in_dead_loop',
                      'loop_ref', 'eptr', 'operator', 'goto']
@@ -457,11 +689,9 @@ class Frame(object):
         return None
 
     def _format_byte(self, byte, format):
-        format_string = "{:" + format + "}"
         if byte is None:
-            zeros = format_string.format(0)
-            return " " * len(zeros)
-        return format_string.format(byte)
+            return " " * len(byte_strings(format)[0])
+        return byte_strings(format)[byte]
 
     def _format_memory(self, memory, format='03d'):
         b = io.StringIO()
@@ -487,16 +717,163 @@ class Stack(list):
     pass
 
 
+class FrameRing(deque):
+    """A stack that keeps only the newest maxlen frames, for long runs
+    that are watched rather than traced. dropped counts the frames that
+    have fallen off the front, so stack[i] is frame dropped + i.
+    """
+
+    def __init__(self, frames=(), maxlen=4096):
+        super().__init__(frames, maxlen)
+        self.dropped = 0
+
+    def append(self, frame):
+        if len(self) == self.maxlen:
+            self.dropped += 1
+        super().append(frame)
+
+    def clear(self):
+        super().clear()
+        self.dropped = 0
+
+
+class Watchpoints(object):
+    """Conditions on machine state that stop Context.run_until. Each one
+    is only checked after an instruction that can actually touch it:
+    '+', '-' and '?' for the current mcell, '?' for icell, '=' for imode.
+    """
+
+    def __init__(self):
+        self.mcell = {}
+        self.icell = set()
+        self.imode = set()
+
+    def __bool__(self):
+        return bool(self.mcell or self.icell or self.imode)
+
+    def clear(self):
+        self.mcell.clear()
+        self.icell.clear()
+        self.imode.clear()
+
+    def check(self, context, operator, mptr, mvalue=None, icell_len=None):
+        if operator in '+-?' and mptr in self.mcell:
+            value = context.mcell[mptr]
+            condition = self.mcell[mptr]
+            if value != mvalue and (condition is None or condition(value)):
+                return 'mcell[{}] {} -> {}'.format(mptr, mvalue, value)
+        if operator == '?' and self.icell:
+            length = len(context.icell)
+            for n in self.icell:
+                if icell_len < n <= length:
+                    return 'icell_len {} -> {}'.format(icell_len, length)
+        if operator == '=' and context.imode in self.imode:
+            return 'imode = {}'.format(context.imode)
+        return None
+
+
+class Channel(object):
+    """Console or modem IO known up front. Input is bytes, a buffer such as
+    an mmap, a str or a file to read it all from; reads are served from it
+    in place, and give 0 once it runs out. Output is collected in a
+    bytearray.
+    """
+
+    def __init__(self, input=b''):
+        if isinstance(input, str):
+            input = input.encode('latin-1')
+        try:
+            self.input = memoryview(input).cast('B')
+        except TypeError:
+            input = input.read()
+            if isinstance(input, str):
+                input = input.encode('latin-1')
+            self.input = memoryview(input)
+        self.position = 0
+        self.output = bytearray()
+
+    def __len__(self):
+        return len(self.input) - self.position
+
+    def copy(self):
+        """A channel at the same position with the same output so far, that
+        reads and writes on its own. The input itself is shared."""
+        channel = copy(self)
+        channel.output = bytearray(self.output)
+        return channel
+
+    def read(self):
+        if self.position >= len(self.input):
+            return '\0'
+        self.position += 1
+        return chr(self.input[self.position - 1])
+
+    def write(self, value):
+        self.output += value.encode('latin-1')
+
+    def getvalue(self):
+        return self.output.decode('latin-1')
+
+
+def _channel(input):
+    if input is None or isinstance(input, Channel):
+        return input
+    return Channel(input)
+
+
+class LimitExceeded(UserWarning):
+    """A program ran into one of its Limits; limit is the name of it."""
+
+    def __init__(self, limit, msg):
+        super().__init__(msg)
+        self.limit = limit
+
+
+class Limits(object):
+    """Bounds on programs run by task 0, across every nesting depth."""
+
+    def __init__(self, depth=8, steps=1000000, memory=1 << 20):
+        self.depth = depth
+        self.steps = steps
+        self.memory = memory
+
+
 class Interpreter(object):
 
     def __init__(self, console_read=None, console_write=None,
-                 modem_read=None, modem_write=None):
+                 modem_read=None, modem_write=None, tasks=None,
+                 task_executor=None, task_queue=16, cache=None):
         self.console_read = console_read
         self.console_write = console_write
         self.modem_read = modem_read
         self.modem_write = modem_write
         self.run_counter = 0
-        self.logger = _log
+        self.logger = logging.getLogger('tbas')
+        self.watchpoints = Watchpoints()
+        self.tasks = dict(TASKS if tasks is None else tasks)
+        self.task_runner = TaskRunner(task_executor, task_queue)
+        self.limits = Limits()
+        # a tbas.cache.ResultCache
+        self.cache = cache
+
+    def register_task(self, number, name, handler, blocking=False):
+        """Add or replace the backend for a task number on this interpreter
+        only; see tbas.tasks for the calling convention."""
+        self.tasks[number] = Task(name, handler, blocking)
+
+    def watch_mcell(self, address, condition=None):
+        """Stop when mcell[address] changes, or when it changes to a value
+        for which condition(value) is true."""
+        self.watchpoints.mcell[address] = condition
+
+    def watch_icell(self, length):
+        self.watchpoints.icell.add(length)
+
+    def watch_imode(self, imode):
+        self.watchpoints.imode.add(imode)
+
+    def clear_watchpoints(self):
+        self.watchpoints.clear()
 
     async def _console_read(self, *args, **kwargs):
         if self.console_read:
@@ -526,17 +903,177 @@ class Interpreter(object):
             return output
         return None
 
-    async def run(self, program):
-        #TODO: ensure this looks like valid TBAS code
+    async def run(self, program, fast=False, trace=None, jit=False,
+                  console=None, modem=None, record=None):
+        """Run a program to completion. If trace is a path, frames are
+        streamed to a trace file there instead of kept on the stack. With
+        jit, hot loops are compiled and run without frames. console and
+        modem pre-feed that channel's input (see Channel), in which case
+        its callbacks aren't used and output is left in ctx.console.output
+        or ctx.modem.output. If record is a path, every read and write is
+        saved there as a Session for replay().
+
+        With a cache, runs with both channels pre-fed and no trace or
+        record are looked up there first; a result is only kept if no task
+        other than a nested program ran. Results from the cache have an
+        empty stack."""
         ctx = Context(program, self)
+        ctx.console = _channel(console)
+        ctx.modem = _channel(modem)
+        key = None if trace or record else self._cache_key(ctx)
+        if key and self._from_cache(ctx, key):
+            return ctx
+        if trace:
+            from tbas.trace import TraceWriter
+            ctx.stack = TraceWriter(trace, ctx.source)
+        if record or key:
+            ctx.events = []
         try:
-            await ctx.run()
+            await ctx.run(fast=fast, jit=jit)
             self.run_counter += 1
+            if key:
+                self._to_cache(ctx, key)
             return ctx
         except Exception as e:
             _log.error(e)
+        finally:
+            await self.task_runner.join()
+            if trace:
+                ctx.stack.close()
+            if record:
+                from tbas.session import Session
+                Session.from_events(ctx.source, ctx.events).save(record)
+        return ctx
+
+    def run_sync(self, program, console=b'', modem=b'', fast=False,
+                 jit=False, max_steps=None):
+        """Run a program with both channels pre-fed, without an event loop.
+        Raises UserWarning if it has to wait on anything, i.e. on a task
+        that runs in the event loop or a full task queue. Uses the cache
+        like run(). See Context.run for max_steps.
+        """
+        ctx = Context(program, self)
+        ctx.console = _channel(console)
+        ctx.modem = _channel(modem)
+        key = self._cache_key(ctx)
+        if key and self._from_cache(ctx, key):
+            if max_steps is not None and ctx.steps > max_steps:
+                msg = 'Program ran over {} steps'.format(max_steps)
+                _log.warn(msg)
+                raise LimitExceeded('steps', msg)
+            return ctx
+        if key:
+            ctx.events = []
+        self._run_sync(ctx, fast, jit, max_steps)
+        if key:
+            self._to_cache(ctx, key)
+        return ctx
+
+    def replay(self, path, fast=False, jit=False):
+        """Rerun a session saved by run(record=path) without an event loop,
+        feeding it the recorded reads. Raises UserWarning at the first
+        write that differs from the recording, in value or in step."""
+        from tbas.session import Session
+        session = Session.load(path)
+        ctx = Context(session.source, self)
+        ctx.console = Channel(session.reads('console'))
+        ctx.modem = Channel(session.reads('modem'))
+        ctx.events = []
+        self._run_sync(ctx, fast, jit)
+        writes = Session.from_events(ctx.source, ctx.events).writes()
+        expected = session.writes()
+        for i, (write, recorded) in enumerate(zip_longest(writes, expected)):
+            if write != recorded:
+                msg = 'Write {} was {}, recorded {}'.format(
+                    i, write, recorded)
+                _log.warn(msg)
+                raise UserWarning(msg)
         return ctx
 
+    def _cache_key(self, ctx):
+        if self.cache is None or ctx.console is None or ctx.modem is None:
+            return None
+        limits = self.limits
+        return self.cache.key(ctx.source, ctx.console.input, ctx.modem.input,
+                              (limits.depth, limits.steps, limits.memory))
+
+    def _from_cache(self, ctx, key):
+        result = self.cache.get(key)
+        if result is None:
+            return False
+        snapshot, console, modem = result
+        ctx.restore(snapshot)
+        for channel, output in ((ctx.console, console), (ctx.modem, modem)):
+            channel.position = len(channel.input)
+            channel.output = bytearray(output)
+        self.run_counter += 1
+        return True
+
+    def _to_cache(self, ctx, key):
+        from tbas.cache import DETERMINISTIC_TASKS
+        if any(e.kind == 'task' and e.value not in DETERMINISTIC_TASKS
+               for e in ctx.events):
+            return
+        self.cache.put(key, ctx.snapshot(), ctx.console.output,
+                       ctx.modem.output)
+
+    def _run_sync(self, ctx, fast, jit, max_steps=None):
+        coro = ctx.run(fast=fast, jit=jit, max_steps=max_steps)
+        while True:
+            try:
+                # a bare yield is run() giving the loop a turn; anything
+                # else is a future it needs to wait on
+                if coro.send(None) is None:
+                    continue
+            except StopIteration:
+                break
+            coro.close()
+            msg = 'Program needs an event loop @{}'.format(ctx.eptr)
+            _log.warn(msg)
+            raise UserWarning(msg)
+        self.task_runner.wait()
+        self.run_counter += 1
+
+    async def run_iter(self, program, fast=False, maxsize=256):
+        """Run a program, yielding Events as it goes: one 'step' per frame
+        plus one per console/modem read or write and task. Execution runs
+        ahead of the consumer by at most maxsize events, and no frames are
+        kept, so memory use is constant however long the program runs. An
+        exception ends the iteration with an 'error' event.
+        """
+        ctx = Context(program, self)
+        ctx.events = []
+        queue = asyncio.Queue(maxsize)
+
+        async def produce():
+            try:
+                while not ctx.finished:
+                    if not (fast and ctx._fast_forward()):
+                        await next(ctx)
+                    for event in ctx.events:
+                        await queue.put(event)
+                    for frame in ctx.stack:
+                        await queue.put(
+                            Event('step', ctx.steps, frame.eptr, frame))
+                    ctx.events.clear()
+                    ctx.stack.clear()
+                await self.task_runner.join()
+                self.run_counter += 1
+            except Exception as e:
+                _log.error(e)
+                await queue.put(Event('error', ctx.steps, ctx.eptr, e))
+            await queue.put(None)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            producer.cancel()
+
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,54 @@
+import pytest
+
+from tbas.alu import BINARY, UNARY
+from tbas.conftest import run
+from tbas.tbas import Context, Interpreter
+
+
+def alu(imode, a, b, **kwargs):
+    # enqueue b, then combine a with it under imode
+    program = ('++++++++=' + '>' + '+' * b + '?' + '[-]' +
+               '+' * imode + '=' + '[-]' + '+' * a + '?' +
+               '>' + '+' * 10 + '[-]')
+    ctx = Context(program, Interpreter())
+    run(ctx.run(**kwargs))
+    return ctx.mcell[1]
+
+
+class TestALU(object):
+    @pytest.mark.parametrize('imode, a, b, result', [
+        (16, 200, 100, 255),
+        (16, 2, 3, 5),
+        (17, 3, 5, 0),
+        (17, 5, 3, 2),
+        (18, 20, 20, 255),
+        (18, 6, 7, 42),
+        (19, 7, 2, 3),
+        (19, 7, 0, 7),
+        (20, 12, 10, 8),
+        (21, 12, 10, 14),
+        (23, 12, 10, 6),
+        ])
+    def test_binary(self, imode, a, b, result):
+        assert BINARY[imode][a << 8 | b] == result
+        assert alu(imode, a, b) == result
+
+    def test_unary(self):
+        assert UNARY[12][0] == ord('a')
+        assert UNARY[13][25] == ord('Z')
+        assert UNARY[14][9] == ord('9')
+        assert bytes(UNARY[15][:8]) == b'+-<>[]=?'
+        assert UNARY[22][0] == 1 and UNARY[22][7] == 0
+        for imode in (12, 13, 14, 15):
+            assert UNARY[imode][200] == 200
+
+    @pytest.mark.parametrize('imode', sorted(BINARY))
+    def test_jit_agrees(self, imode):
+        program = ('++++++++=' + '+' * 20 + '[>+++?<-]' +
+                   '+' * imode + '=' + '+' * 30 + '[>?<-]')
+        results = []
+        for jit in (False, True):
+            ctx = Context(program, Interpreter())
+            run(ctx.run(jit=jit))
+            results.append((ctx.mcell, bytes(ctx.icell)))
+        assert results[0] == results[1]
@@ -0,0 +1,76 @@
+import io
+import time
+import wave
+
+from concurrent.futures import ThreadPoolExecutor
+
+from tbas import audio
+from tbas.conftest import run
+from tbas.tasks import SinkHandler, Task, TaskRunner, audio_tasks
+from tbas.tbas import Interpreter
+
+
+class TestAudio(object):
+    def test_tone_length(self):
+        pcm = audio.tone((440,), 100)
+        assert len(pcm) == 800 * audio.SAMPLE_WIDTH
+        assert audio.tone((), 50) == bytes(400 * audio.SAMPLE_WIDTH)
+
+    def test_tone_cached(self):
+        assert audio.tone(audio.DTMF['5'], 100) is \
+            audio.tone(audio.DTMF['5'], 100)
+
+    def test_tone_amplitude(self):
+        samples = memoryview(audio.tone((1000,), 10)).cast('h')
+        assert max(samples) > audio.AMPLITUDE * 0.9
+        assert min(samples) < -audio.AMPLITUDE * 0.9
+
+    def test_dial(self):
+        digit = (audio.DIGIT_MS + audio.GAP_MS) * 8 * audio.SAMPLE_WIDTH
+        pause = audio.PAUSE_MS * 8 * audio.SAMPLE_WIDTH
+        assert len(audio.render_dial('555-1212')) == 7 * digit
+        assert len(audio.render_dial('1,2')) == 2 * digit + pause
+        assert audio.render_dial('12') == \
+            audio.render_dial('1') + audio.render_dial('2')
+
+    def test_render_tones(self):
+        pcm = audio.render_tones(bytes([69, 10, 0, 5]))
+        assert len(pcm) == (800 + 400) * audio.SAMPLE_WIDTH
+
+    def test_wav_sink(self, tmpdir):
+        sink = audio.WavSink(str(tmpdir))
+        path = sink.write('dialer', audio.render_dial('911'))
+        with wave.open(path) as w:
+            assert w.getframerate() == audio.SAMPLE_RATE
+            assert w.getnframes() == 3 * 1200
+
+    def test_dialer_task(self):
+        stream = io.BytesIO()
+        tbas = Interpreter()
+        tbas.tasks.update(audio_tasks(audio.StreamSink(stream)))
+        # enqueue '5' (53), then run task 9
+        program = '++++++++=>' + '+' * 53 + '?<-=>' + '[-]' + '+' * 9 + '?'
+        run(tbas.run(program))
+        assert stream.getvalue() == audio.render_dial('5')
+
+    def test_stream_order(self):
+        # later tasks finish first, and the one in the middle fails
+        def render(data, sink=None):
+            time.sleep(0.01 * (5 - data[0]))
+            if data[0] == 2:
+                raise ValueError('boom')
+            sink.write('test', data)
+
+        stream = io.BytesIO()
+        runner = TaskRunner(ThreadPoolExecutor(max_workers=5))
+        task = Task('test', SinkHandler(render, audio.StreamSink(stream)),
+                    False)
+
+        async def submit():
+            for i in range(5):
+                await runner.submit(None, task, bytes([i]))
+            await runner.join()
+
+        run(submit())
+        runner.shutdown()
+        assert stream.getvalue() == bytes([0, 1, 3, 4])
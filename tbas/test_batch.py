@@ -0,0 +1,52 @@
+import json
+import pytest
+
+from tbas.batch import run_batch, run_record
+
+
+class TestBatch(object):
+    c_abc = '++=++++++[->++++++++<]>+?+?+?'
+
+    def records(self):
+        return [
+            json.dumps({'id': 1, 'program': self.c_abc, 'expected': 'ABC'}),
+            json.dumps({'id': 2, 'program': '+++=>?>?<<-=>?>?',
+                        'input': 'hi', 'jit': True}),
+            '',
+            json.dumps({'id': 3, 'program': '+[]', 'limits': {'steps': 50},
+                        'expected': ''}),
+            json.dumps({'id': 4, 'program': '+' * 40 + '=?'}),
+            'not json',
+            ]
+
+    def check(self, results):
+        results = [json.loads(line) for line in results]
+        assert [r['id'] for r in results] == [1, 2, 3, 4, None]
+        abc, echo, loop, bad, garbage = results
+        assert abc['output'] == 'ABC' and abc['passed']
+        assert abc['steps'] == 133 and abc['error'] is None
+        assert echo['output'] == 'hi'
+        assert loop['limit'] == 'steps' and not loop['passed']
+        assert 'Unknown io mode 40' in bad['error']
+        assert bad['limit'] is None and bad['steps'] == 42
+        assert garbage['error']
+
+    def test_inline(self):
+        self.check(run_batch(self.records()))
+
+    def test_workers(self):
+        self.check(run_batch(self.records(), workers=2, window=2))
+
+    def test_nested_limits(self):
+        # task 0 runs its buffer, which runs itself again
+        program = '++++++=?+=-------?'
+        result = json.loads(run_record(json.dumps(
+            {'program': program, 'limits': {'depth': 3}})))
+        assert result['limit'] == 'depth'
+
+    @pytest.mark.parametrize('engine', [{}, {'fast': True}, {'jit': True}])
+    def test_steps_limit(self, engine):
+        record = dict(program='+[]', limits={'steps': 100000}, **engine)
+        result = json.loads(run_record(json.dumps(record)))
+        assert result['limit'] == 'steps'
+        assert result['steps'] > 100000
@@ -0,0 +1,113 @@
+import pytest
+
+from tbas.cache import ResultCache
+from tbas.conftest import run
+from tbas.tbas import Interpreter, LimitExceeded
+
+
+class TestResultCache(object):
+    # echo two characters, then count down
+    program = '+++=>?>?<<-=>?>?<<--=>>>+++++[?-]'
+
+    def test_hit(self, tmpdir):
+        with ResultCache(str(tmpdir.join('results.db'))) as cache:
+            tbas = Interpreter(cache=cache)
+            first = tbas.run_sync(self.program, console=b'hi')
+            second = tbas.run_sync(self.program, console=b'hi')
+            assert (cache.hits, cache.misses) == (1, 1)
+            assert second.console.output == first.console.output == \
+                bytearray(b'hi54321')
+            assert second.mcell == first.mcell
+            assert second.steps == first.steps
+            assert len(second.stack) == 0
+
+            ctx = run(tbas.run(self.program, console=b'hi', modem=b''))
+            assert cache.hits == 2
+            assert ctx.console.getvalue() == 'hi54321'
+
+            tbas.run_sync(self.program, console=b'ho')
+            assert cache.misses == 2
+            assert len(cache) == 2
+
+    def test_persistent(self, tmpdir):
+        path = str(tmpdir.join('results.db'))
+        with ResultCache(path) as cache:
+            Interpreter(cache=cache).run_sync(self.program, console=b'hi')
+        with ResultCache(path) as cache:
+            ctx = Interpreter(cache=cache).run_sync(self.program,
+                                                    console=b'hi')
+            assert cache.hits == 1
+            assert ctx.console.getvalue() == 'hi54321'
+
+    def test_live_io_skips_cache(self, tmpdir):
+        async def read(n):
+            return 'h'
+
+        with ResultCache(str(tmpdir.join('results.db'))) as cache:
+            tbas = Interpreter(console_read=read, cache=cache)
+            run(tbas.run(self.program))
+            assert len(cache) == 0
+            assert cache.misses == 0
+
+    def test_tasks_skip_cache(self, tmpdir):
+        calls = []
+        with ResultCache(str(tmpdir.join('results.db'))) as cache:
+            tbas = Interpreter(cache=cache)
+            tbas.register_task(1, 'count', lambda data: calls.append(data))
+            tbas.run_sync('+++++++=-------+?')
+            tbas.task_runner.shutdown()
+            assert calls == [b'']
+            assert len(cache) == 0
+
+    def test_limits(self, tmpdir):
+        # task 0 runs twenty '+' built up in icell
+        program = ('++++++++=>' + '+' * 43 + '>' + '+' * 20 + '[<?>-]' +
+                   '<<-=-------?')
+        with ResultCache(str(tmpdir.join('results.db'))) as cache:
+            Interpreter(cache=cache).run_sync(program)
+            tight = Interpreter(cache=cache)
+            tight.limits.steps = 10
+            with pytest.raises(LimitExceeded):
+                tight.run_sync(program)
+            assert cache.hits == 0
+
+    def test_eviction(self, tmpdir):
+        with ResultCache(str(tmpdir.join('results.db')),
+                         max_bytes=1000) as cache:
+            tbas = Interpreter(cache=cache)
+            for c in 'abcdefgh':
+                tbas.run_sync(self.program, console=c.encode() * 2)
+            assert cache.size <= 1000
+            assert 0 < len(cache) < 8
+            tbas.run_sync(self.program, console=b'hh')
+            assert cache.hits == 1
+
+    def test_used_index(self, tmpdir):
+        with ResultCache(str(tmpdir.join('results.db'))) as cache:
+            plan = cache.db.execute(
+                'EXPLAIN QUERY PLAN SELECT key, size FROM results '
+                'ORDER BY used').fetchall()
+            assert 'results_used' in str(plan)
+
+    def test_recency_batched(self, tmpdir):
+        path = str(tmpdir.join('results.db'))
+
+        def used(cache):
+            return [key for key, in cache.db.execute(
+                'SELECT key FROM results ORDER BY used')]
+
+        with ResultCache(path) as cache:
+            cache.put(b'a', b'snapshot', b'', b'')
+            cache.put(b'b', b'snapshot', b'', b'')
+            assert cache.get(b'a')
+            # the hit is only in memory until a flush
+            assert cache.db.in_transaction is False
+            assert used(cache) == [b'a', b'b']
+            size = cache.size
+        with ResultCache(path) as cache:
+            assert used(cache) == [b'b', b'a']
+            assert cache.size == size
+            cache.put(b'b', b'longer snapshot', b'', b'')
+            assert cache.size == size + 7
+            assert cache.size == cache.db.execute(
+                'SELECT SUM(size) FROM results').fetchone()[0]
@@ -0,0 +1,145 @@
+import io
+import pytest
+
+from tbas import compiler
+from tbas.compiler import (Program, compile_program, load_program,
+                           read_program, strip_comments)
+from tbas.conftest import run
+from tbas.jit import BUDGET
+from tbas.tbas import Context, Interpreter, LimitExceeded
+
+
+class TestCompiler(object):
+    def test_position_map(self):
+        p = Program('+ +\n[-] x?')
+        assert p.code == '++[-]?'
+        assert list(p.positions) == [0, 2, 4, 5, 6, 9]
+        assert p.eptr(5) == 9
+        assert p.eptr(6) == len(p.source)
+        assert p.index(3) == 2
+        assert p.index(7) == 5
+
+    def test_fold_and_match(self):
+        p = Program('+++[>>-]]')
+        assert list(p.runs[:3]) == [3, 2, 1]
+        assert p.jumps[3] == 7
+        assert p.jumps[7] == 3
+        assert p.jumps[8] == -1
+
+    def test_analysis(self):
+        p = Program(']++ +[>>-]-[')
+        assert p.n_folded == 8
+        assert p.unmatched == [0, 11]
+
+    def test_stripped_source(self):
+        p = Program('++[-]?')
+        assert list(p.positions) == list(range(6))
+        assert Program('caf\xe9 +').code == '+'
+
+    def test_strip_comments(self):
+        source = 'add two: ++ [loop -] \xe9 ?\n'.encode()
+        assert strip_comments(source) == b'++[-]?'
+        assert read_program(io.BytesIO(source), chunk=3) == '++[-]?'
+
+    @pytest.mark.parametrize('threshold', [0, 1 << 20])
+    def test_load_program(self, tmpdir, monkeypatch, threshold):
+        monkeypatch.setattr(compiler, 'MMAP_THRESHOLD', threshold)
+        path = tmpdir.join('abc.tbas')
+        path.write('A: ++=++++++\n[->++++++++<]\n>+?+?+? (ABC)\n')
+        source = load_program(str(path), chunk=4)
+        assert source == '++=++++++[->++++++++<]>+?+?+?'
+
+    def test_cache(self):
+        assert compile_program('+?') is compile_program('+?')
+
+    @pytest.mark.parametrize('program', [
+        '++=++++++[->++++++++<]>+?+?+?',
+        '+++[?-]',
+        '[?]++[->+<]>?',
+        '++++++[>++++++[>+++++++<-]<-]>>=?',
+        ])
+    def test_fast_forward_agrees(self, program):
+        results = []
+        for fast in (False, True):
+            out = []
+
+            async def write(value):
+                out.append(value)
+
+            tbas = Interpreter(console_write=write)
+            ctx = run(tbas.run(program, fast=fast))
+            results.append((''.join(out), ctx.mcell, ctx.mptr, ctx.steps,
+                            ctx.eptr, ctx.loop_ref))
+        assert results[0] == results[1]
+
+    @pytest.mark.parametrize('jit', [False, True])
+    def test_fast_forward_budget(self, jit):
+        ctx = Context('+[]', Interpreter())
+        with pytest.raises(LimitExceeded):
+            run(ctx.run(fast=True, jit=jit, max_steps=200000))
+        assert 200000 < ctx.steps <= 200000 + BUDGET
+
+    def test_eptr_is_source_offset(self):
+        tbas = Interpreter()
+        ctx = run(tbas.run('+ + = >  ++ \n ++ ++ ?'))
+        assert ctx.stack[-1].eptr == 20
+        assert ctx.stack[-1].operator == '?'
+        # ?25 stores eptr + 1 of the '?' in the original source
+        ctx = run(tbas.run('+++++ +++++ +++++ +++++ +++++ = ?'))
+        assert ctx.mcell[0] == 33
+
+    @pytest.mark.parametrize('kwargs', [{}, {'fast': True}, {'jit': True}])
+    def test_eptr_saturates(self, tmpdir, kwargs):
+        # past 255, ?25 stores 255, which the alu, snapshots and traces
+        # can all take; the loop is hot enough to be compiled
+        from tbas.cache import ResultCache
+        program = (' ' * 300 + '+' * 25 + '=>' + '+' * 20 + '[<?>-]' +
+                   '>' + '+' * 16 + '=<<?')
+        with ResultCache(str(tmpdir.join('results.db'))) as cache:
+            ctx = Interpreter(cache=cache).run_sync(program, **kwargs)
+            assert ctx.mcell[0] == 255
+            assert len(cache) == 1
+        trace = str(tmpdir.join('run.trace'))
+        ctx = run(Interpreter().run(program, trace=trace, **kwargs))
+        assert ctx.mcell[0] == 255
+
+    def test_bytecode(self, tmpdir):
+        source = 'A: ++=++++++ [->++++++++<] >+?+?+? ]['
+        path = str(tmpdir.join('abc.tbc'))
+        Program(source).save(path)
+        p, loaded = Program(source), Program.load(path)
+        assert loaded.source == source
+        assert loaded.code == p.code
+        for key in ('positions', 'runs', 'jumps'):
+            assert list(getattr(loaded, key)) == list(getattr(p, key))
+        assert loaded.n_folded == p.n_folded
+        assert loaded.unmatched == p.unmatched
+        assert loaded.index(20) == p.index(20)
+
+    def test_run_bytecode(self, tmpdir):
+        path = str(tmpdir.join('abc.tbc'))
+        Program('++=++++++[->++++++++<]>+?+?+?').save(path)
+        out = []
+
+        async def write(value):
+            out.append(value)
+
+        ctx = run(Interpreter(console_write=write).run(Program.load(path),
+                                                       jit=True))
+        assert ''.join(out) == 'ABC'
+        assert ctx.steps == 133
+
+    def test_path_is_not_loaded(self, tmpdir):
+        # a program that happens to name a file is still just source
+        path = str(tmpdir.join('abc.tbc'))
+        Program('++=++++++[->++++++++<]>+?+?+?').save(path)
+        ctx = Context(path, Interpreter())
+        assert ctx.source == path
+        run(ctx.run())
+        assert ctx.steps < 133
+
+    def test_not_bytecode(self, tmpdir):
+        path = tmpdir.join('bad.tbc')
+        path.write_binary(b'TBtr' + bytes(20))
+        with pytest.raises(ValueError):
+            Program.load(str(path))
@@ -0,0 +1,89 @@
+
+import pytest
+
+from tbas import display
+from tbas.conftest import run
+from tbas.tasks import display_tasks
+from tbas.tbas import Interpreter
+
+
+class ListSink(object):
+    def __init__(self, limit=8):
+        self.limit = limit
+        self.written = []
+
+    def write(self, name, frames):
+        from itertools import islice
+        self.written.append((name, list(islice(frames, self.limit))))
+
+
+class TestDisplay(object):
+    def test_font(self):
+        assert len(display.FONT) == 95 * 5
+        assert display.glyph('A') == bytes.fromhex('7e1111117e00')
+        assert display.glyph('\n') == display.glyph('?')
+        assert display.glyph('A') is display.glyph('A')
+
+    def test_format_frame(self):
+        rows = display.format_frame(display.raster('H')).splitlines()
+        assert rows[0] == '#...#.'
+        assert rows[3] == '#####.'
+        assert rows[7] == '......'
+
+    def test_scroll(self):
+        frames = list(display.scroll_frames('HI', blanks=2, width=8))
+        # 2 + 12 + 2 columns through an 8 column window
+        assert len(frames) == 9
+        assert frames[0] == b'\0\0' + display.raster('HI')[:6]
+        assert all(len(f) == 8 for f in frames)
+
+    def test_scroll_steps_ppong(self):
+        frames = list(display.scroll_frames(
+            'HELLO', ppong=1, steps=4, width=8))
+        forward = list(display.scroll_frames('HELLO', steps=4, width=8))
+        assert frames == forward + forward[-2:0:-1]
+
+    def test_scroll_short_text(self):
+        assert list(display.scroll_frames('A', width=8)) == \
+            [display.glyph('A') + b'\0\0']
+
+    def test_blinken(self):
+        frames = display.blinken_frames(1, 0, 0xff, 1, 1, 0, 0, width=8)
+        first = [next(frames) for _ in range(4)]
+        assert first[0] == first[1] == b'\xff\xff' + bytes(6)
+        assert first[2] == b'\0\xff\xff' + bytes(5)
+
+    def test_blinken_wrap_and_lfo(self):
+        frames = display.blinken_frames(0, 0, 1, 255, 0, 2, 1, width=4)
+        first = [next(frames) for _ in range(5)]
+        assert first[0] == b'\x01\0\0\0'
+        assert first[1] == b'\0\0\0\x01'
+        assert first[2] == b'\0\0\x01\0'
+        assert first[3] == first[4] == bytes(4)
+
+    def test_frame_file(self, tmpdir):
+        path = str(tmpdir.join('hi.tbf'))
+        frames = list(display.scroll_frames('HI'))
+        assert display.write_frames(path, iter(frames)) == len(frames)
+        assert display.read_frames(path) == frames
+
+    def test_frame_sink_limit(self, tmpdir):
+        sink = display.FrameSink(str(tmpdir), limit=10)
+        path = sink.write('blinken', display.blinken_frames(
+            0, 0, 1, 1, 0, 0, 0))
+        assert len(display.read_frames(path)) == 10
+
+    def test_gif(self, tmpdir):
+        pytest.importorskip('PIL')
+        path = str(tmpdir.join('hi.gif'))
+        display.write_gif(path, display.scroll_frames('HI'))
+
+    def test_scroller_task(self):
+        sink = ListSink()
+        tbas = Interpreter()
+        tbas.tasks.update(display_tasks(sink))
+        # enqueue ppong 0, steps 0, blanks 0 and 'A' (65), then task 4
+        program = ('++++++++=>???' + '+' * 65 + '?<-=>' + '[-]' + '++++?')
+        run(tbas.run(program))
+        assert sink.written == [
+            ('scroller', [display.glyph('A').ljust(32, b'\0')])]
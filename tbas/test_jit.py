@@ -0,0 +1,73 @@
+import pytest
+
+from tbas.compiler import Program
+from tbas.conftest import run
+from tbas.jit import HOT_LOOP, compile_loop
+from tbas.tbas import Context, Interpreter
+
+
+def execute(program, **kwargs):
+    out = []
+
+    async def write(value):
+        out.append(value)
+
+    ctx = Context(program, Interpreter(console_write=write))
+    run(ctx.run(**kwargs))
+    return (''.join(out), ctx.mcell, ctx.mptr, ctx.icell, ctx.imode,
+            ctx.steps, ctx.eptr, ctx.loop_ref), ctx
+
+
+class TestJIT(object):
+    @pytest.mark.parametrize('program', [
+        '++=++++++[->++++++++<]>+?+?+?',
+        '++++++++++++[?-]',
+        '++++++++=>++++++++++++[?-]<+=>[?>]',
+        '+++++++++++++=>' + '+' * 12 + '[>+++?[-]<-]',
+        '++++++[>++++++[>+++++++<-]<-]>>?',
+        '+' * 24 + '=>>>++++++++++++[<?>-[>]<]',
+        '+' * 25 + '=>>' + '+' * 20 + '[>?[-]>' + '+' * 9 + '[<+>-]<<-]',
+        '++++++++++[>[-]<-]>+++++++++[<++++++++++>-]<[>+<-]',
+        '++++++=' + '+' * 20 + '[>?<-]',
+        ])
+    def test_agrees_with_step_engine(self, program):
+        stepped, _ = execute(program)
+        compiled, ctx = execute(program, jit=True)
+        assert stepped == compiled
+
+    def test_hot_loops_compile(self):
+        program = '+' * 20 + '[>++++++++<-]>?'
+        _, ctx = execute(program, jit=True)
+        loops = ctx.program.loops
+        assert list(loops) == [20]
+        # the loop ran HOT_LOOP - 1 times on the step engine
+        assert len([f for f in ctx.stack if f.msg is None]) == \
+            20 + (HOT_LOOP - 1) * 13 + 2
+        assert ctx.stack[-3].msg.startswith('compiled loop')
+
+    def test_deoptimize_on_io(self):
+        stepped, _ = execute('+++++++++++++++[?-]')
+        compiled, ctx = execute('+++++++++++++++[?-]', jit=True)
+        assert stepped == compiled
+        assert compiled[0] == '151413121110987654321'
+
+    def test_budget(self):
+        program = Program('+[]')
+        loop = compile_loop(program, 1)
+        ctx = Context(program, Interpreter())
+        run(ctx.step())
+        assert loop(ctx, budget=100) >= 100
+        assert ctx.iptr == 1
+        assert ctx.loop_ref == []
+        run(ctx.step())
+        assert ctx.loop_ref == [1]
+
+    def test_unmatched(self):
+        assert compile_loop(Program('+[->+<'), 1) is None
+
+    def test_watchpoints_disable(self):
+        tbas = Interpreter()
+        tbas.watch_mcell(1)
+        ctx = Context('+' * 20 + '[>+<-]', tbas)
+        run(ctx.run(jit=True))
+        assert not ctx.program.loops or 20 not in ctx.program.loops
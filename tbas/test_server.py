@@ -0,0 +1,108 @@
+import asyncio
+import socket
+import threading
+import pytest
+
+from tbas.server import (Client, Result, Server, decode_request,
+                         decode_response, encode_request, encode_response)
+
+
+@pytest.fixture
+def server(tmpdir):
+    server = Server(str(tmpdir.join('tbas.sock')), workers=2, window=4,
+                    max_steps=100000)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server
+
+    async def stop():
+        server.close()
+        await asyncio.sleep(0.01)
+
+    asyncio.run_coroutine_threadsafe(stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+class TestServer(object):
+    c_abc = '++=++++++[->++++++++<]>+?+?+?'
+
+    def test_protocol(self):
+        request = encode_request(self.c_abc, b'in', fast=True)
+        program, console, modem, fast, jit = decode_request(request[4:])
+        assert (program, bytes(console), bytes(modem), fast, jit) == \
+            (self.c_abc, b'in', b'', True, False)
+        result = Result(False, 3, 1000, b'A', b'', 'oops')
+        assert decode_response(encode_response(result)[4:]) == result
+
+    def test_run(self, server):
+        with Client(server.path) as client:
+            result = client.run(self.c_abc)
+            assert result.ok
+            assert result.console == b'ABC'
+            assert result.steps == 133
+            assert result.elapsed > 0
+            echo = client.run('+++=>?>?<<-=>?>?', console=b'hi', jit=True)
+            assert echo.console == b'hi'
+
+    def test_error(self, server):
+        with Client(server.path) as client:
+            result = client.run('+' * 40 + '=?')
+            assert not result.ok
+            assert 'Unknown io mode 40' in result.error
+            assert client.run(self.c_abc).console == b'ABC'
+
+    @pytest.mark.parametrize('fast', [False, True])
+    def test_endless(self, server, fast):
+        with Client(server.path) as client:
+            # as many as there are workers, then one that ends
+            results = list(client.run_many(
+                [('+[]', b'', b'', fast)] * 2 + [(self.c_abc,)]))
+        assert [r.ok for r in results] == [False, False, True]
+        assert 'ran over 100000 steps' in results[0].error
+        assert results[2].console == b'ABC'
+
+    def test_run_many(self, server):
+        requests = [('+' * n + '?', b'', b'') for n in range(50)]
+        with Client(server.path) as client:
+            results = list(client.run_many(requests, window=8))
+        assert [r.console for r in results] == \
+            [str(n).encode() for n in range(50)]
+        assert server.served == 50
+
+    def test_run_many_large(self, tmpdir):
+        # a server that, like Server under drain(), stops reading while
+        # its answers aren't being read
+        path = str(tmpdir.join('echo.sock'))
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(1)
+        answer = Result(True, 1, 1, b'x' * (1 << 20), b'', '')
+
+        def serve():
+            connection, _ = listener.accept()
+            with connection, connection.makefile('rb') as f:
+                while True:
+                    header = f.read(4)
+                    if len(header) < 4:
+                        return
+                    f.read(int.from_bytes(header, 'little'))
+                    connection.sendall(encode_response(answer))
+
+        threading.Thread(target=serve, daemon=True).start()
+        requests = [('+?', b'y' * (1 << 20), b'')] * 16
+        results = []
+
+        def run_many():
+            with Client(path) as client:
+                results.extend(client.run_many(requests, window=16))
+
+        thread = threading.Thread(target=run_many, daemon=True)
+        thread.start()
+        thread.join(10)
+        listener.close()
+        assert not thread.is_alive()
+        assert results == [answer] * 16
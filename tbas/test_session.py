@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+
+from tbas.conftest import run
+from tbas.session import Session
+from tbas.tbas import Interpreter
+
+
+class TestSession(object):
+    # read two characters from the console, echo them to the modem, and
+    # count down on the console
+    program = '+++=>?>?<<+=>?>?<<----=>>>+++++[?-]'
+
+    def record(self, path):
+        written = []
+        typed = iter('hi')
+
+        async def read(n):
+            await asyncio.sleep(0)
+            return next(typed)
+
+        async def write(value):
+            written.append(value)
+
+        tbas = Interpreter(console_read=read, console_write=write,
+                           modem_write=write)
+        run(tbas.run(self.program, record=path))
+        return written
+
+    def test_roundtrip(self, tmpdir):
+        path = str(tmpdir.join('abc.session'))
+        written = self.record(path)
+        assert ''.join(written) == 'hi54321'
+        session = Session.load(path)
+        assert session.source == self.program
+        assert session.reads('console') == b'hi'
+        assert [value for _, _, value in session.writes()] == written
+
+    @pytest.mark.parametrize('kwargs', [{}, {'fast': True}, {'jit': True}])
+    def test_replay(self, tmpdir, kwargs):
+        path = str(tmpdir.join('abc.session'))
+        self.record(path)
+        ctx = Interpreter().replay(path, **kwargs)
+        assert ctx.modem.getvalue() == 'hi'
+        assert ctx.console.getvalue() == '54321'
+
+    def test_mismatch(self, tmpdir):
+        path = str(tmpdir.join('abc.session'))
+        self.record(path)
+        session = Session.load(path)
+        kind, steps, _ = session.records[0]
+        session.records[0] = (kind, steps, 'x')
+        session.save(path)
+        with pytest.raises(UserWarning):
+            Interpreter().replay(path)
+
+    def test_not_a_session(self, tmpdir):
+        path = tmpdir.join('bad.session')
+        path.write_binary(b'TBtr' + bytes(16))
+        with pytest.raises(ValueError):
+            Session.load(str(path))
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import threading
+
+import pytest
+
+from itertools import islice
+
+from tbas.conftest import run
+from tbas.display import WIDTH
+from tbas.tasks import TASKS, TaskRunner, blinken
+from tbas.tbas import Context, Interpreter
+
+
+# enqueue 3 then run task 3 with icell = b'\x03'
+TASK_3 = '++++++++=>+++?<-=>?'
+
+
+class TestTasks(object):
+    def test_registry(self):
+        assert TASKS[3].name == 'blinken'
+        assert not TASKS[3].blocking
+        assert TASKS[0].blocking
+
+    def test_blinken_short_buffer(self, caplog):
+        # the missing parameters are zero: a still, unblinking block
+        written = []
+
+        class Sink(object):
+            def write(self, name, frames):
+                written.append((name, list(islice(frames, 3))))
+
+        with caplog.at_level(logging.INFO, logger='tbas.tasks'):
+            blinken(b'\x01\x02\xff', sink=Sink())
+        assert 'blinken 1 2 255 0 0 0 0' in caplog.text
+        frame = bytearray(WIDTH)
+        frame[2:4] = b'\xff\xff'
+        assert written == [('blinken', [bytes(frame)] * 3)]
+
+    def test_dispatch(self):
+        calls = []
+        tbas = Interpreter()
+        tbas.register_task(3, 'blinken', calls.append)
+        ctx = run(tbas.run(TASK_3))
+        assert ctx.finished
+        assert calls == [b'\x03']
+        assert ctx.icell == bytearray()
+        # the shared registry is untouched
+        assert TASKS[3].handler is blinken
+
+    def test_blocking(self):
+        seen = []
+
+        async def handler(context, data):
+            seen.append((context.steps, data))
+
+        tbas = Interpreter()
+        tbas.register_task(3, 'test', handler, blocking=True)
+        run(tbas.run(TASK_3))
+        assert seen == [(19, b'\x03')]
+
+    def test_unknown_task(self):
+        ctx = Context('+++++++=>+++++++?', Interpreter())
+        with pytest.raises(UserWarning):
+            run(ctx.run())
+
+    def test_bounded_queue(self):
+        release = threading.Event()
+        started = []
+
+        def handler(data):
+            started.append(data)
+            release.wait(5)
+
+        tbas = Interpreter(task_queue=1)
+        tbas.register_task(3, 'test', handler)
+        ctx = Context(TASK_3 + '?', tbas)
+
+        async def go():
+            loop = asyncio.get_event_loop()
+            loop.call_later(0.05, release.set)
+            await ctx.run()
+            # the second task had to wait for the first to finish
+            assert release.is_set()
+            await tbas.task_runner.join()
+
+        run(go())
+        assert started == [b'\x03', b'']
+
+    def test_errors_are_logged(self, caplog):
+        def handler(data):
+            raise ValueError('boom')
+
+        tbas = Interpreter()
+        tbas.register_task(3, 'test', handler)
+        run(tbas.run(TASK_3))
+        assert 'boom' in caplog.text
+
+    def test_runner_shutdown(self):
+        runner = TaskRunner()
+        assert runner.executor is runner.executor
+        runner.shutdown()
+        assert runner._executor is None
+
+
+class TestNested(object):
+    def test_child_shares_io(self):
+        output = []
+
+        async def write(value):
+            output.append(value)
+
+        tbas = Interpreter(console_write=write)
+        # enqueue '?', then run it as a child program
+        program = '++++++++=>' + '+' * 63 + '?<-=>[-]?'
+        ctx = run(tbas.run(program))
+        assert ctx.finished
+        assert output == ['0']
+        assert ctx.nested_steps == 1
+
+    def test_depth_limit(self):
+        # buffers its own source and runs it, forever
+        ctx = Context('++++++=?+=>?', Interpreter())
+        with pytest.raises(UserWarning, match='Nesting deeper than 8'):
+            run(ctx.run())
+
+    def test_step_limit(self):
+        tbas = Interpreter()
+        tbas.limits.steps = 5000
+        ctx = Context('', tbas)
+        with pytest.raises(UserWarning, match='over 5000 steps'):
+            run(ctx.run_child('+[]'))
+        assert ctx.nested_steps == 5000
+
+    def test_memory_limit(self):
+        tbas = Interpreter()
+        tbas.limits.memory = 600
+        ctx = Context('', tbas)
+        run(ctx.run_child('+'))
+        with pytest.raises(UserWarning, match='over 600 bytes'):
+            run(ctx.run_child('++++++=?' + '+' * 100))
+
+    def test_child_compile_cached(self):
+        ctx = Context('', Interpreter())
+        first = run(ctx.run_child('+++'))
+        second = run(ctx.run_child('+++'))
+        assert first.program is second.program
+        assert first.depth == 1 and first.root is ctx
@@ -1,8 +1,11 @@
+import asyncio
 import io
 import logging
 import pytest
 
-from tbas.tbas import Interpreter
+from tbas.conftest import run
+from tbas.tbas import (YIELD_EVERY, Channel, Context, FrameRing,
+                       Interpreter)
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -62,3 +65,240 @@ class TestTBAS(object):
         ctx = self.tbas.run(p)
         assert ctx.io_buffer.getvalue() == p.encode()
 
+
+
+class TestContext(object):
+    c_abc = '++=++++++[->++++++++<]>+?+?+?'
+
+    def test_step(self):
+        ctx = Context(self.c_abc, Interpreter())
+        assert run(ctx.step(3)) == 3
+        assert ctx.eptr == 3
+        assert ctx.imode == 2
+        assert len(ctx.stack) == 3
+        assert run(ctx.step(1000)) == 130
+        assert ctx.finished
+
+    def test_run_until_breakpoint(self):
+        ctx = Context(self.c_abc, Interpreter())
+        ctx.breakpoints = {11}
+        hits = []
+        while run(ctx.run_until()):
+            hits.append((ctx.eptr, ctx.mcell[1]))
+        assert hits == [(11, 8 * n) for n in range(8)]
+        assert ctx.mcell[1] == 67
+
+    def test_run_until_predicate(self):
+        ctx = Context(self.c_abc, Interpreter())
+        assert run(ctx.run_until(lambda c: c.mcell[1] == 16))
+        assert ctx.eptr == 20
+        assert not run(ctx.run_until())
+        assert ctx.finished
+
+    def test_watch_mcell(self):
+        for predicate in (None, lambda c: False):
+            tbas = Interpreter()
+            tbas.watch_mcell(1, lambda v: v >= 20)
+            ctx = Context(self.c_abc, tbas)
+            assert run(ctx.run_until(predicate))
+            assert ctx.mcell[1] == 20
+            assert ctx.eptr == 16
+            assert ctx.watch_hit == 'mcell[1] 19 -> 20'
+
+    def test_watch_icell_and_imode(self):
+        tbas = Interpreter()
+        tbas.watch_imode(8)
+        tbas.watch_icell(2)
+        ctx = Context('++++++++=?+?-?+?', tbas)
+        assert run(ctx.run_until())
+        assert ctx.watch_hit == 'imode = 8'
+        assert run(ctx.run_until())
+        assert ctx.watch_hit == 'icell_len 1 -> 2'
+        assert ctx.icell == bytearray([8, 9])
+        assert not run(ctx.run_until())
+
+    def test_snapshot_restore(self):
+        ctx = Context(self.c_abc, Interpreter())
+        run(ctx.run_until(lambda c: c.mcell[1] == 20))
+        blob = ctx.snapshot()
+        assert len(blob) < 400
+
+        other = Context(self.c_abc, Interpreter())
+        other.restore(blob)
+        for key in ['mcell', 'mptr', 'icell', 'imode', 'loop_ref', 'eptr',
+                    'goto', 'steps']:
+            assert getattr(other, key) == getattr(ctx, key)
+        run(other.run())
+        assert other.mcell[1] == 67
+
+        with pytest.raises(ValueError):
+            Context('+', Interpreter()).restore(blob)
+
+    def test_fork(self):
+        ctx = Context(self.c_abc, Interpreter())
+        run(ctx.step(20))
+        child = ctx.fork()
+        run(child.run())
+        assert child.mcell[1] == 67
+        assert ctx.steps == 20
+        assert ctx.mcell[1] != 67
+        assert len(ctx.stack) == 20
+        assert len(child.stack) == child.steps - 20
+
+    def test_fork_stacks(self, tmpdir):
+        from tbas.trace import TraceWriter
+        ctx = Context(self.c_abc, Interpreter())
+        ctx.stack = FrameRing(maxlen=5)
+        run(ctx.step(20))
+        child = ctx.fork()
+        assert isinstance(child.stack, FrameRing)
+        assert child.stack.maxlen == 5 and len(child.stack) == 0
+        ctx.stack = TraceWriter(str(tmpdir.join('run.trace')), ctx.source)
+        child = ctx.fork()
+        run(child.run())
+        ctx.stack.close()
+        assert child.mcell[1] == 67
+
+    def test_fork_prefed(self):
+        # read a, then fork: both go on to read b and c
+        tbas = Interpreter()
+        ctx = Context('+++=>?>?>?<<<-=>?>?>?', tbas)
+        ctx.console = Channel(b'abc')
+        run(ctx.step(6))
+        child = ctx.fork()
+        assert child.loop_counts is not ctx.loop_counts
+        run(child.run())
+        run(ctx.run())
+        for c in (ctx, child):
+            assert c.mcell[1:4] == [97, 98, 99]
+            assert c.console.getvalue() == 'abc'
+
+
+class TestRunIter(object):
+    def collect(self, program, **kwargs):
+        async def write(value):
+            pass
+
+        async def consume():
+            tbas = Interpreter(console_write=write)
+            return [event async for event in tbas.run_iter(program, **kwargs)]
+
+        return run(consume())
+
+    def test_events(self):
+        events = self.collect('++=++++++[->++++++++<]>+?+?+?')
+        steps = [e for e in events if e.kind == 'step']
+        writes = [e.value for e in events if e.kind == 'console_write']
+        assert len(steps) == 133
+        assert [e.steps for e in steps] == list(range(1, 134))
+        assert writes == ['A', 'B', 'C']
+        assert events[-1].value.eptr == 28
+
+    def test_fast_events(self):
+        events = self.collect('++=++++++[->++++++++<]>+?+?+?', fast=True)
+        writes = [e.value for e in events if e.kind == 'console_write']
+        assert writes == ['A', 'B', 'C']
+        assert events[-1].steps == 133
+
+    def test_error(self):
+        events = self.collect('+]', maxsize=1)
+        assert events[-1].kind == 'error'
+        assert events[-1].eptr == 1
+
+
+class TestChannels(object):
+    def test_prefed_console(self):
+        # echo two characters as ascii, then a digit as decimal
+        tbas = Interpreter()
+        ctx = run(tbas.run('+++=>?>?<<-=>?>?<<-=>>>?<<<-=>>>?',
+                           console=b'xy7'))
+        assert ctx.console.output == bytearray(b'xy7')
+        assert len(ctx.console) == 0
+
+    @pytest.mark.parametrize('modem, value', [
+        (b'A', 65), (b'7', 55), (b'\xff', 255), (b'', 0)])
+    def test_prefed_modem(self, modem, value):
+        # imode 5 reads a byte from the modem as ascii
+        ctx = Interpreter().run_sync('+++++=?', modem=modem)
+        assert ctx.mcell[0] == value
+
+    def test_sources(self):
+        import mmap
+        with io.BytesIO(b'AB') as f:
+            assert Channel(f).read() == 'A'
+        assert Channel(io.StringIO('AB')).read() == 'A'
+        assert Channel('AB').read() == 'A'
+        assert Channel(bytearray(b'AB')).read() == 'A'
+        m = mmap.mmap(-1, 2)
+        m.write(b'AB')
+        channel = Channel(m)
+        assert channel.read() + channel.read() == 'AB'
+        assert channel.read() == '\0'
+        channel.input.release()
+        m.close()
+
+    def test_run_sync(self):
+        tbas = Interpreter()
+        ctx = tbas.run_sync('+++=>?>?>?<<<-=>?>?>?>' + '+' * 30 + '[-]',
+                            console=b'hi', fast=True)
+        assert ctx.finished
+        assert ctx.console.getvalue() == 'hi\0'
+        assert tbas.run_counter == 1
+
+    def test_run_sync_long(self):
+        ctx = Interpreter().run_sync('+' * 200 + '[>+<-]>[-]')
+        assert ctx.steps > YIELD_EVERY
+
+    def test_run_sync_needs_loop(self):
+        async def read(n):
+            await asyncio.sleep(0.01)
+            return 'A'
+
+        tbas = Interpreter(console_read=read)
+        with pytest.raises(UserWarning):
+            tbas.run_sync('+++=?', console=None)
+
+
+class TestFrame(object):
+    def test_format_memory(self):
+        ctx = Context('++=++++++[->++++++++<]>+?+?+?', Interpreter())
+        run(ctx.run())
+        rows = ctx.stack[-1].format_mcell('03d').splitlines()
+        assert len(rows) == 16
+        assert rows[0].startswith('0x000: 000 067 000')
+        rows = ctx.stack[-1].format_mcell('c').splitlines()
+        assert rows[0].startswith('0x000: . C .')
+
+
+class TestImports(object):
+    # a finder ahead of the real ones notes every attempt to import Qt, so
+    # these mean something whether or not PyQt5 is installed
+    code = """if True:
+        import sys
+        attempts = []
+        class Finder(object):
+            def find_spec(self, name, path=None, target=None):
+                if name.split('.')[0] in ('PyQt5', 'quamash'):
+                    attempts.append(name)
+                return None
+        sys.meta_path.insert(0, Finder())
+        try:
+            import {}
+        except ImportError:
+            attempts.append('ImportError')
+        print(attempts + [m for m in sys.modules
+                          if m.startswith(('PyQt5', 'quamash'))])
+        """
+
+    def qt_imports(self, modules):
+        import subprocess
+        import sys
+        return subprocess.check_output(
+            [sys.executable, '-c', self.code.format(modules)]).strip()
+
+    def test_headless_imports_skip_qt(self):
+        assert self.qt_imports(
+            'tbas.tbas, tbas.cli, tbas.trace, tbas.worker') == b'[]'
+
+    def test_gui_imports_qt(self):
+        assert self.qt_imports('tbas.gui').startswith(b"['PyQt5'")
@@ -0,0 +1,65 @@
+
+from tbas.conftest import run
+from tbas.tbas import Context, Interpreter
+from tbas.trace import COLUMNS, TraceReader, TraceWriter
+
+
+class TestTrace(object):
+    c_abc = '++=++++++[->++++++++<]>+?+?+?>++++++=?+?+?---?'
+
+    def test_roundtrip(self, tmpdir):
+        path = str(tmpdir.join('abc.trace'))
+        tbas = Interpreter()
+        stack = run(tbas.run(self.c_abc)).stack
+        ctx = run(tbas.run(self.c_abc, trace=path))
+        assert ctx.stack.n_records == len(stack)
+
+        with TraceReader(path) as trace:
+            assert trace.source == self.c_abc
+            assert len(trace) == len(stack)
+            for i in [0, 1, 50, len(stack) - 1]:
+                frame = trace[i]
+                for key in ['eptr', 'operator', 'mptr', 'mcell', 'imode',
+                            'icell', 'loop_depth']:
+                    assert getattr(frame, key) == getattr(stack[i], key)
+            assert list(trace.column('eptr')) == [f.eptr for f in stack]
+
+    def test_blocks(self, tmpdir):
+        path = str(tmpdir.join('blocks.trace'))
+        ctx = Context(self.c_abc, Interpreter())
+        run(ctx.run())
+        with TraceWriter(path, self.c_abc, block_size=7) as writer:
+            for frame in ctx.stack:
+                writer.append(frame)
+        with TraceReader(path) as trace:
+            assert len(trace.blocks) == (len(ctx.stack) + 6) // 7
+            for i, frame in enumerate(ctx.stack):
+                assert trace[i].mcell == frame.mcell
+                assert trace[i].icell == frame.icell
+            for name, _, _ in COLUMNS:
+                assert len(trace.column(name)) == len(ctx.stack)
+
+    def test_fast_frames(self, tmpdir):
+        program = '+?>+>++>+++?' + '[>+++<-]>?'
+        path = str(tmpdir.join('fast.trace'))
+        stepped = run(Interpreter().run(program)).stack
+        fast = run(Interpreter().run(program, fast=True)).stack
+        run(Interpreter().run(program, fast=True, trace=path))
+        with TraceReader(path) as trace:
+            assert len(trace) == len(fast) < len(stepped)
+            for i, frame in enumerate(fast):
+                assert trace[i].mcell == frame.mcell
+            assert trace[2].mcell[:4] == [1, 1, 2, 3]
+            assert trace[-1].mcell == stepped[-1].mcell
+
+    def test_fast_frames_across_blocks(self, tmpdir):
+        program = '++[>+>++<<-]?' * 3
+        path = str(tmpdir.join('blocks.trace'))
+        ctx = Context(program, Interpreter())
+        run(ctx.run(fast=True))
+        with TraceWriter(path, program, block_size=3) as writer:
+            for frame in ctx.stack:
+                writer.append(frame)
+        with TraceReader(path) as trace:
+            for i, frame in enumerate(ctx.stack):
+                assert trace[i].mcell == frame.mcell
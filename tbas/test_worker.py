@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+import threading
+
+from tbas.tbas import Context, FrameRing, Interpreter
+from tbas.worker import RunWorker, threadsafe
+
+
+class TestWorker(object):
+    def test_run(self):
+        ctx = Context('++=++++++[->++++++++<]>+?+?+?', Interpreter())
+        worker = RunWorker(ctx, 'run')
+        worker.start()
+        assert worker.done.wait(5)
+        assert ctx.finished
+        assert worker.steps == len(ctx.stack) == 133
+        assert worker.error is None
+
+    def test_frames_bounded(self, monkeypatch):
+        monkeypatch.setattr(RunWorker, 'frames', 50)
+        ctx = Context('+' * 100 + '[-]', Interpreter())
+        worker = RunWorker(ctx, 'run')
+        worker.start()
+        assert worker.done.wait(5)
+        assert isinstance(ctx.stack, FrameRing)
+        assert len(ctx.stack) == 50
+        assert ctx.stack.dropped == worker.steps - 50
+        assert ctx.stack[-1].eptr == 102
+
+    def test_cancel(self):
+        ctx = Context('+[]', Interpreter())
+        worker = RunWorker(ctx, 'run')
+        worker.start()
+        while ctx.steps < 100:
+            pass
+        worker.cancel()
+        assert worker.done.wait(5)
+        assert worker.cancelled
+        assert not ctx.finished
+
+    @pytest.mark.parametrize('method, args', [
+        ('run', (True,)), ('run_until', ())])
+    def test_cancel_fast(self, method, args):
+        ctx = Context('+[]', Interpreter())
+        ctx.breakpoints.add(0)
+        worker = RunWorker(ctx, method, *args)
+        worker.start()
+        while ctx.steps < 100000:
+            pass
+        worker.cancel()
+        assert worker.done.wait(5)
+        assert worker.cancelled
+
+    def test_threadsafe_io(self):
+        loop = asyncio.new_event_loop()
+        written = []
+        threads = set()
+
+        async def read(n):
+            threads.add(threading.current_thread())
+            return 'A'
+
+        async def write(value):
+            threads.add(threading.current_thread())
+            written.append(value)
+
+        tbas = Interpreter(console_read=threadsafe(read, loop),
+                           console_write=threadsafe(write, loop, wait=False))
+        ctx = Context('+++=?>++=<+?', tbas)
+        worker = RunWorker(ctx, 'run')
+        worker.start()
+        loop.run_until_complete(
+            loop.run_in_executor(None, worker.done.wait, 5))
+        loop.run_until_complete(asyncio.sleep(0))
+        assert written == ['B']
+        assert threads == {threading.current_thread()}
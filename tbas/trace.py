@@ -0,0 +1,283 @@
+import mmap
+import struct
+
+from array import array
+from bisect import bisect_right
+
+from tbas.tbas import Frame, WORKING_MEMORY_BYTES
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+TRACE_MAGIC = b'TBtr'
+TRACE_VERSION = 2
+
+# name, array typecode, numpy dtype
+COLUMNS = [
+    ('eptr', 'I', '<u4'),
+    ('operator', 'B', 'u1'),
+    ('mptr', 'B', 'u1'),
+    ('mvalue', 'B', 'u1'),
+    ('imode', 'B', 'u1'),
+    ('icell_len', 'I', '<u4'),
+    ('loop_depth', 'H', '<u2'),
+    ]
+
+# magic, version, block size, len(mcell), len(source)
+_file_header = struct.Struct('<4sBIHI')
+# records, icell events, bytes of icell events, mcell events
+_block_header = struct.Struct('<IIII')
+# record index, len(icell)
+_icell_event = struct.Struct('<II')
+# record index, followed by all of mcell
+_mcell_event = struct.Struct('<I')
+
+
+class TraceWriter(object):
+    """Streams frames to a columnar trace file instead of keeping them.
+
+    The file is a sequence of blocks of up to block_size records. Each block
+    starts with a full copy of mcell as of its first record, followed by
+    every change to icell within the block, a full copy of mcell for every
+    record that changed more than the cell at mptr (fast forward and
+    compiled loop frames), and then one array per column. Only a block's
+    worth of records is held in memory.
+
+    A TraceWriter can stand in for a Context's stack.
+    """
+
+    def __init__(self, path, source, block_size=4096):
+        self.file = open(path, 'wb')
+        self.block_size = block_size
+        self.file.write(_file_header.pack(
+            TRACE_MAGIC, TRACE_VERSION, block_size, WORKING_MEMORY_BYTES,
+            len(source.encode())))
+        self.file.write(source.encode())
+        self.n_records = 0
+        self._start_block()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.n_records
+
+    def _start_block(self):
+        self.columns = [array(typecode) for _, typecode, _ in COLUMNS]
+        self.mcell = None
+        self.icell = None
+        self.icell_events = []
+        self.mcell_events = []
+
+    def _flush_block(self):
+        if not len(self.columns[0]):
+            return
+        events = b''.join(
+            _icell_event.pack(i, len(icell)) + bytes(icell)
+            for i, icell in self.icell_events)
+        self.file.write(_block_header.pack(
+            len(self.columns[0]), len(self.icell_events), len(events),
+            len(self.mcell_events)))
+        self.file.write(bytes(self.mcell))
+        self.file.write(events)
+        self.file.write(b''.join(
+            _mcell_event.pack(i) + bytes(mcell)
+            for i, mcell in self.mcell_events))
+        for column in self.columns:
+            column.tofile(self.file)
+        self._start_block()
+
+    def append(self, frame):
+        n = len(self.columns[0])
+        if n == 0:
+            self.mcell = frame.mcell
+            self.last_mcell = list(frame.mcell)
+        else:
+            # the reader replays one cell per record; keep a copy of
+            # everything when a frame changed more than that
+            last = self.last_mcell
+            last[frame.mptr] = frame.mcell[frame.mptr]
+            if last != frame.mcell:
+                self.mcell_events.append((n, frame.mcell))
+                self.last_mcell = list(frame.mcell)
+        if frame.icell != self.icell:
+            self.icell = frame.icell
+            self.icell_events.append((n, frame.icell))
+        eptr, operator, mptr, mvalue, imode, icell_len, loop_depth = \
+            self.columns
+        eptr.append(frame.eptr)
+        operator.append(ord(frame.operator or ' '))
+        mptr.append(frame.mptr)
+        mvalue.append(frame.mcell[frame.mptr])
+        imode.append(frame.imode)
+        icell_len.append(len(frame.icell))
+        loop_depth.append(len(frame.loop_ref))
+        self.n_records += 1
+        if n + 1 == self.block_size:
+            self._flush_block()
+
+    def close(self):
+        if not self.file.closed:
+            self._flush_block()
+            self.file.close()
+
+
+class TraceFrame(Frame):
+    """A frame rebuilt from a trace file. Only the traced fields are set."""
+
+    loop_depth = None
+
+    def __init__(self, **values):
+        self.noop = False
+        self.msg = None
+        self.in_dead_loop = None
+        self.loop_ref = None
+        self.goto = None
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    @property
+    def loop_ptr(self):
+        return None
+
+
+class TraceReader(object):
+    """Memory-maps a trace file written by TraceWriter. Opening only scans
+    the block headers; records are decoded on access. Supports len(),
+    indexing (returning TraceFrame) and whole columns via column().
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.block_size, self.mcell_len,
+         source_len) = _file_header.unpack_from(self.mmap)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError('Not a version {} trace'.format(TRACE_VERSION))
+        offset = _file_header.size
+        self.source = self.mmap[offset:offset + source_len].decode()
+        offset += source_len
+
+        self.blocks = []
+        self.n_records = 0
+        width = sum(array(typecode).itemsize for _, typecode, _ in COLUMNS)
+        while offset < len(self.mmap):
+            n, n_events, events_len, n_mcell = _block_header.unpack_from(
+                self.mmap, offset)
+            events_len += n_mcell * (_mcell_event.size + self.mcell_len)
+            self.blocks.append((offset, n, n_events, events_len, n_mcell))
+            offset += (_block_header.size + self.mcell_len + events_len +
+                       n * width)
+            self.n_records += n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.n_records
+
+    def close(self):
+        self.mmap.close()
+
+    def _column_offsets(self, block):
+        offset, n, _, events_len, _ = self.blocks[block]
+        offset += _block_header.size + self.mcell_len + events_len
+        offsets = {}
+        for name, typecode, dtype in COLUMNS:
+            offsets[name] = (offset, typecode, dtype)
+            offset += n * array(typecode).itemsize
+        return offsets
+
+    def _block_column(self, block, name, stop=None):
+        offset, typecode, _ = self._column_offsets(block)[name]
+        values = array(typecode)
+        if stop is None:
+            stop = self.blocks[block][1]
+        values.frombytes(self.mmap[offset:offset + stop * values.itemsize])
+        return values
+
+    def _icell_events(self, block):
+        offset, _, n_events, _, _ = self.blocks[block]
+        offset += _block_header.size + self.mcell_len
+        events = []
+        for _ in range(n_events):
+            i, length = _icell_event.unpack_from(self.mmap, offset)
+            offset += _icell_event.size
+            events.append((i, bytearray(self.mmap[offset:offset + length])))
+            offset += length
+        return events, offset
+
+    def _mcell_event(self, block, index):
+        # (record, offset of mcell) of the last copy of mcell at or before
+        # index, None if there isn't one
+        _, offset = self._icell_events(block)
+        n_mcell = self.blocks[block][4]
+        size = _mcell_event.size + self.mcell_len
+        found = None
+        for _ in range(n_mcell):
+            i, = _mcell_event.unpack_from(self.mmap, offset)
+            if i > index:
+                break
+            found = (i, offset + _mcell_event.size)
+            offset += size
+        return found
+
+    def column(self, name):
+        """The named column for the whole trace, as a NumPy array if NumPy
+        is installed, otherwise as an array.array."""
+        parts = []
+        for block in range(len(self.blocks)):
+            offset, typecode, dtype = self._column_offsets(block)[name]
+            n = self.blocks[block][1]
+            if numpy is not None:
+                parts.append(numpy.frombuffer(
+                    self.mmap, dtype=dtype, count=n, offset=offset))
+            else:
+                parts.append(self._block_column(block, name))
+        if numpy is not None:
+            return numpy.concatenate(parts) if parts else numpy.array([])
+        values = array(dict((c[0], c[1]) for c in COLUMNS)[name])
+        for part in parts:
+            values.extend(part)
+        return values
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.n_records
+        if not 0 <= index < self.n_records:
+            raise IndexError('trace index out of range')
+        block, i = divmod(index, self.block_size)
+        start, offset = 0, self.blocks[block][0] + _block_header.size
+        copy = self._mcell_event(block, i)
+        if copy:
+            start, offset = copy
+        mcell = list(self.mmap[offset:offset + self.mcell_len])
+
+        # replay cell writes since the last copy of mcell
+        columns = dict(
+            (name, self._block_column(block, name, i + 1))
+            for name, _, _ in COLUMNS)
+        for mptr, mvalue in zip(columns['mptr'][start + 1:],
+                                columns['mvalue'][start + 1:]):
+            mcell[mptr] = mvalue
+
+        events, _ = self._icell_events(block)
+        icell = events[bisect_right([e[0] for e in events], i) - 1][1]
+
+        return TraceFrame(
+            eptr=columns['eptr'][i],
+            operator=chr(columns['operator'][i]),
+            mptr=columns['mptr'][i],
+            imode=columns['imode'][i],
+            loop_depth=columns['loop_depth'][i],
+            mcell=mcell,
+            icell=icell)
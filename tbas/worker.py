@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+from tbas.tbas import FrameRing
+
+
+def threadsafe(coroutine_function, loop, wait=True):
+    """Wrap a coroutine function so that calling it from another thread's
+    event loop runs it on loop instead. With wait=False the caller doesn't
+    wait for it to finish; calls still run in order.
+    """
+    async def call(*args, **kwargs):
+        future = asyncio.run_coroutine_threadsafe(
+            coroutine_function(*args, **kwargs), loop)
+        if wait:
+            return await asyncio.wrap_future(future)
+        return None
+    return call
+
+
+class RunWorker(threading.Thread):
+    """Runs one of a Context's execution methods (run, step, run_until)
+    on a private event loop in a daemon thread.
+
+    The owner polls steps and done rather than being called back. The
+    context's stack is swapped for a FrameRing that keeps only the last
+    few thousand frames, so a long run doesn't grow without bound; they
+    can be read at any time.
+    """
+
+    frames = 4096
+
+    def __init__(self, context, method='run', *args):
+        super().__init__(daemon=True)
+        self.context = context
+        if not isinstance(context.stack, FrameRing):
+            context.stack = FrameRing(context.stack, self.frames)
+        self.method = method
+        self.args = args
+        self.loop = asyncio.new_event_loop()
+        self.task = None
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+    @property
+    def steps(self):
+        return self.context.steps
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        coroutine = getattr(self.context, self.method)(*self.args)
+        self.task = self.loop.create_task(coroutine)
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            self.cancelled = True
+        except Exception as e:
+            self.error = e
+            self.context.interpreter.logger.error(e)
+        finally:
+            self.loop.close()
+            self.done.set()
+
+    def _cancel(self):
+        if self.task:
+            self.task.cancel()
+
+    def cancel(self):
+        try:
+            self.loop.call_soon_threadsafe(self._cancel)
+        except RuntimeError:
+            # the loop has already finished
+            pass